@@ -9,7 +9,6 @@ Gratia Job Usage Record Library
 
 import gratia.common.GratiaCore as GratiaCore
 import re
-import socket
 import time
 
 # For Backward compatibility
@@ -513,7 +512,7 @@ class UsageRecord(record.Record):
 
         # Add the record indentity
 
-        self.XmlData.append('<RecordIdentity urwg:recordId="' + socket.getfqdn() + ':' + str(global_state.RecordPid) + '.'
+        self.XmlData.append('<RecordIdentity urwg:recordId="' + global_state.getHostFQDN() + ':' + str(global_state.RecordPid) + '.'
                             + str(record.RecordId) + '" urwg:createTime="' + TimeToString(time.gmtime()) + '" />\n')
         record.RecordId += 1
  
@@ -33,6 +33,9 @@ def close_and_unlink_lock():
         fd.close()
 atexit.register(close_and_unlink_lock)
 
+# Values of EnableProbe (compared case-insensitively) that disable the probe
+disabled_values = frozenset(("0", "false"))
+
 def CheckPreconditions(check_enabled=True):
     """
     Checks the following things:
@@ -49,7 +52,7 @@ def CheckPreconditions(check_enabled=True):
 
     if check_enabled:
         enabled = GratiaCore.Config.getConfigAttribute("EnableProbe")
-        if (not enabled) or (enabled == "0") or (enabled.lower() == "false"):
+        if (not enabled) or (enabled.lower() in disabled_values):
             raise Exception("Probe %s is not enabled" % probe_name)
 
     data_folder = GratiaCore.Config.get_DataFolder()
@@ -10,18 +10,25 @@ import os
 import pwd
 import re
 import sys
+import stat
+import shutil
 import time
 import types
 import signal
 import random
 import os.path
+import datetime
+import functools
+import itertools
 import optparse
 import subprocess
 
+from urllib.parse import urlsplit
+
 from typing import List, Tuple
 
 from gratia.common.Gratia import DebugPrint
-from gratia.common.debug import DebugPrintTraceback
+from gratia.common.debug import DebugPrintTraceback, debug_enabled
 from gratia.common import GratiaCore
 from gratia.common import GratiaWrapper
 from gratia.common import Gratia
@@ -35,14 +42,27 @@ import classad as classadLib
 # HACK: allow case-insensitive `attr in ad` checks
 # https://jira.opensciencegrid.org/browse/SOFTWARE-3017
 # https://github.com/opensciencegrid/gratia-probe/pull/24
+# Only needed for old bindings; current ones are case-insensitive already.
+# Building a set of lower-cased attribute names per JobAd instead was measured
+# to be several times slower than these lookups for typical (~100 attribute)
+# history ads, so keep relying on ClassAd lookups.
 if 'name' not in classadLib.ClassAd({"Name": 123}):
     classadLib.ClassAd.__contains__ = lambda ad,attr: ad.get(attr) is not None
 
+# Features of the ClassAd bindings only need to be checked once, not per JobAd
+CLASSAD_HAS_EVAL = hasattr(classadLib.ClassAd, 'eval')
+CLASSAD_HAS_LOOKUP = hasattr(classadLib.ClassAd, 'lookup')
+
 g_alternate_records = {}
 g_probe_config = None
+g_extra_attributes = None
+g_condor_config_val_cache = {}
 
 prog_version = "%%%RPMVERSION%%%"
-max_batch_size = 500
+max_alternate_procs = 4
+history_file_chunksize = 16
+history_file_buffer_size = 1 << 20
+history_file_min_read_size = 64 << 10
 
 min_start_time = time.time() - 120*86400
 
@@ -60,6 +80,71 @@ RESOURCE_NAME_ATTRS = [
     'MATCH_EXP_JOBGLIDEIN_ResourceName'
 ]
 
+# JobAd attributes copied as-is into the usage record, grouped by where they
+# appear in the record.  Each entry is (UsageRecord method, JobAd attributes in
+# order of preference, description, convert value to a string).
+JOB_IDENTITY_ATTRS = (
+    ('LocalUserId', ('Owner',), None, False),
+    ('GlobalUsername', ('User',), None, False),
+    # a pre-routed job's AuthToken attrs are copied with "orig_" prefix
+    # in the routed job (SOFTWARE-5185, HTCONDOR-1071)
+    ('DN', ('x509userproxysubject', 'orig_AuthTokenSubject'), None, False),
+    # orig_AuthTokenIssuer is the VO info for SciTokens
+    ('VOName', ('x509UserProxyFirstFQAN', 'orig_AuthTokenIssuer'), None, False),
+    ('ReportableVOName', ('x509UserProxyVOName', 'orig_AuthTokenIssuer'), None, False),
+)
+
+JOB_STATUS_ATTRS = (
+    ('Status', ('ExitStatus',), "Condor Exit Status", False),
+    ('WallDuration', ('RemoteWallClockTime',), "Was entered in seconds", False),
+)
+
+# CPU times reported as TimeDurations, and whether to check them for invalid
+# values with invalidDuration().  Missing values are taken as 0.
+CPU_TIME_ATTRS = (
+    ('RemoteUserCpu', True),
+    ('LocalUserCpu', False),
+    ('RemoteSysCpu', True),
+    ('LocalSysCpu', False),
+)
+
+JOB_SUSPENSION_ATTRS = (
+    ('TimeDuration', ('CumulativeSuspensionTime',), 'CumulativeSuspensionTime', False),
+    ('TimeDuration', ('CommittedSuspensionTime',), 'CommittedSuspensionTime', False),
+    ('TimeDuration', ('CommittedTime',), 'CommittedTime', False),
+)
+
+JOB_TIME_ATTRS = (
+    ('StartTime', ('JobStartDate',), "Was entered in seconds", False),
+    ('QueueTime', ('QDate',), "Was entered in seconds", False),
+)
+
+JOB_QUEUE_ATTRS = (
+    ('Queue', ('JobUniverse',), "Condor's JobUniverse field", True),
+    ('NodeCount', ('MaxHosts',), "max", False),
+)
+
+# JobAd attributes reported as AdditionalInfo when present, as
+# (AdditionalInfo name, JobAd attribute)
+JOB_INFO_ATTRS = (
+    ('CondorMyType', 'MyType'),
+    ('AccountingGroup', 'AccountingGroup'),
+)
+
+JOB_EXIT_INFO_ATTRS = (
+    ('ExitSignal', 'ExitSignal'),
+    ('ExitCode', 'ExitCode'),
+    ('condor.JobStatus', 'JobStatus'),
+)
+
+PEGASUS_INFO_ATTRS = (
+    ('PegasusRootWFUUID', 'pegasus_root_wf_uuid'),
+    ('PegasusWFUUID', 'pegasus_wf_uuid'),
+    ('PegasusVersion', 'pegasus_version'),
+    ('PegasusApp', 'pegasus_wf_app'),
+    ('PegasusWFXformation', 'pegasus_wf_xformation'),
+)
+
 # --- classes -------------------------------------------------------------------------
 
 class IgnoreClassadException(Exception):
@@ -115,6 +200,12 @@ is assumed to be 00:00:00 if omitted""",
         dest="history_end_time", 
         default=None)    
 
+    parser.add_option("-j", "--jobs",
+        help="""Number of processes used to convert HTCondor history files
+into usage records.  Records are always sent by the main process.""",
+        dest="jobs",
+        default=1, type="int")
+
     parser.add_option("-v", "--verbose", 
         help="Enable verbose logging to stdout.",
         default=False, action="store_true", dest="verbose")
@@ -135,40 +226,76 @@ is assumed to be 00:00:00 if omitted""",
 
     return opts, args
 
-condor_version_re = re.compile("^\$CondorVersion:\s*(.*)\s*\$\n\$CondorPlatform:\s*(.*)\s*\$")
+def condor_version_value(line):
+    """
+    Return the value of a "$CondorVersion: ... $" or "$CondorPlatform: ... $"
+    string, as produced by condor_version and the HTCondor Python bindings
+    """
+    return line.strip().strip('$').partition(':')[2].strip()
+
 def getCondorVersion():
+    """
+    Return the HTCondor version and platform as "<version> / <platform>".
+
+    If CondorLocation is set, this runs condor_version from that install.
+    Otherwise the version of the imported HTCondor Python bindings is
+    reported, which avoids running condor_version but may differ from the
+    installed HTCondor if the bindings come from another release.
+    """
     path = GratiaCore.Config.getConfigAttribute("CondorLocation")
-    fd = None
+    if not path:
+        try:
+            return "%s / %s" % (condor_version_value(htcondor.version()),
+                                condor_version_value(htcondor.platform()))
+        except AttributeError:
+            DebugPrint(4, "HTCondor Python bindings do not provide version(); "
+                          "falling back to condor_version")
+
+    cmd = "condor_version"
     if path:
-        cmd = os.path.join(path, "bin", "condor_version")
-        if os.path.exists(cmd):
-            fd = os.popen(cmd)
+        if os.path.exists(os.path.join(path, "bin", cmd)):
+            cmd = os.path.join(path, "bin", cmd)
         else:
             DebugPrint(0, "Unable to find specified condor_version: %s.  "
-                          "Falling back to searching $PATH." % cmd)
-    if fd == None:
-        fd = os.popen("condor_version")
-    version = fd.read()
-    if fd.close():
+                          "Falling back to searching $PATH." %
+                          os.path.join(path, "bin", cmd))
+    try:
+        proc = subprocess.Popen([cmd], stdout=subprocess.PIPE,
+                                universal_newlines=True)
+    except OSError:
         raise Exception("Unable to invoke condor_version")
-    m = condor_version_re.match(version.strip())
-    if m:
-        return "%s / %s" % m.groups()
+    version = proc.communicate()[0]
+    if proc.returncode:
+        raise Exception("Unable to invoke condor_version")
+    lines = version.strip().splitlines()
+    if len(lines) >= 2 and lines[0].startswith("$CondorVersion:") and \
+            lines[1].startswith("$CondorPlatform:"):
+        return "%s / %s" % (condor_version_value(lines[0]), condor_version_value(lines[1]))
     raise Exception("Unable to parse condor_version output: %s" % version)
 
-logfile_re = re.compile("^history\.(?:.*?\#)?\d+\.\d+")
+# Per-job history files are named history.<cluster>.<proc>, optionally with a
+# '#'-terminated prefix before the job id.  [^#]* cannot overlap with the '#',
+# so a failed match never backtracks.
+logfile_re = re.compile(r"history\.(?:[^#]*#)?(\d+)\.(\d+)")
 def logfiles_to_process(args):
     for arg in args:
-        if os.path.isfile(arg) and os.stat(arg).st_size:
-            DebugPrint(5, "Processing logfile %s" % arg)
-            yield arg
-        elif os.path.isdir(arg):
+        try:
+            arg_stat = os.stat(arg)
+        except OSError:
+            continue
+        if stat.S_ISREG(arg_stat.st_mode):
+            if arg_stat.st_size:
+                if debug_enabled(5):
+                    DebugPrint(5, "Processing logfile %s" % arg)
+                yield arg
+        elif stat.S_ISDIR(arg_stat.st_mode):
             DebugPrint(5, "Processing directory %s." % arg)
-            for logfile in os.listdir(arg):
-                m = logfile_re.match(logfile)
-                if m:
-                    DebugPrint(5, "Processing logfile %s" % logfile)
-                    yield os.path.join(arg, logfile)
+            with os.scandir(arg) as entries:
+                for entry in entries:
+                    if logfile_re.fullmatch(entry.name) and entry.is_file():
+                        if debug_enabled(5):
+                            DebugPrint(5, "Processing logfile %s" % entry.name)
+                        yield entry.path
 
 
 def get_num_procs(job_ad):
@@ -180,15 +307,26 @@ def get_num_procs(job_ad):
 
     If none of the above are set or do not evaluate to an integer, return 0
     """
-    procs = 0
     for attr in PROC_ATTRS:
         try:
-            procs = int(job_ad.eval(attr))
-            break
+            return get_int_attr(job_ad, attr)
         except (KeyError, ValueError):
             continue
 
-    return procs
+    return 0
+
+def get_int_attr(job_ad, attr):
+    """Return the value of a JobAd attribute as an integer.  Most attributes are
+    integer literals, so only fall back to evaluating the attribute when the
+    value cannot be converted directly.
+
+    Raises KeyError if the attribute is missing or ValueError if it does not
+    evaluate to a number.
+    """
+    try:
+        return int(job_ad[attr])
+    except TypeError:
+        return int(job_ad.eval(attr))
 
 def get_condor_ids(condor_service: str = "") -> Tuple[int, int]:
     """Return the UID/GID of the user running the relevant condor daemons (i.e., IDs specified by CONDOR_IDS or the
@@ -231,7 +369,6 @@ def become_condor(condor_service: str = ""):
         raise utils.InternalError("ERROR: failed to drop privileges to the 'condor' user") from exc
 
 
-condor_history_re = re.compile("^history.(\d+)\.(\d+)")
 def main(probe_name):
     if os.getuid() == 0:
         try:
@@ -276,7 +413,7 @@ def main(probe_name):
     if opts.condor_history is True:
         process_using_condor_history(opts.history_start_time, opts.history_end_time)
     else:
-        process_history_dirs(dirs)
+        process_history_dirs(dirs, opts.jobs)
    
 def process_using_condor_history(start_time=None, end_time=None):
     if start_time is not None or end_time is not None:
@@ -310,31 +447,31 @@ def process_using_condor_history(start_time=None, end_time=None):
     process_condor_history(start_time, end_time)
     DebugPrint(-11, "RUNNING condor_meter MANUALLY Finished")
 
+@functools.lru_cache(maxsize=16)
 def parse_date(date_string):
     """
-    Parse a date/time string in %m-%d-%Y or %m-%d-%Y %H:%M:%S format
-    
+    Parse a local date/time string in %Y-%m-%d or %Y-%m-%d %H:%M:%S format
+    (or any other ISO 8601 format accepted by datetime.fromisoformat)
+
     Returns None if string can't be parsed, otherwise returns time formatted
     as the number of seconds since the Epoch
-    """    
-    result = None
+    """
     try:
-        result = time.strptime(date_string, "%Y-%m-%d %H:%M:%S")        
-        return int(round(time.mktime(result)))
-    except ValueError:
-        pass
-    except Exception as e:
+        return int(datetime.datetime.fromisoformat(date_string).timestamp())
+    except (TypeError, ValueError):
         return None
-
-    try:
-        result = time.strptime(date_string, "%Y-%m-%d")
-        return int(round(time.mktime(result)))
-    except ValueError:
+    except AttributeError:
+        # Python < 3.7
         pass
-    except Exception as e:
-        return None
-    
-    return result
+
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return int(datetime.datetime.strptime(date_string, date_format).timestamp())
+        except ValueError:
+            continue
+        except TypeError:
+            break
+    return None
 
 def register_gratia():
     GratiaCore.RegisterReporter("condor_meter")
@@ -352,28 +489,55 @@ def register_gratia():
     GratiaCore.RegisterService("Condor", condor_version)
     GratiaCore.setProbeBatchManager("condor")
 
-def process_history_dirs(dirs):
+def process_history_dirs(dirs, jobs=1):
     submit_count = 0
     found_count = 0
     alternate_count = 0
     logs_found = 0
     logfile_errors = 0
+
+    def valid_logfiles():
+        nonlocal logs_found
+        for log in logfiles_to_process(dirs):
+            logs_found += 1
+            _, logfile = os.path.split(log)
+            # Make sure the filename is in a reasonable format
+            if logfile_re.fullmatch(logfile):
+                yield log
+            else:
+                DebugPrint(2, "Ignoring history file with invalid name: %s" % log)
+
     # Note we are not ordering logfiles by type, as we don't want to
     # pull them all into memory at once.
     DebugPrint(4, "We will process the following directories: %s." % ", ".join(dirs))
-    for log in logfiles_to_process(dirs):
-        logs_found += 1
-        _, logfile = os.path.split(log)
-        # Make sure the filename is in a reasonable format
-        m = condor_history_re.match(logfile)
-        if m:
-            e = None
-            try:
-                cnt_submit, cnt_found, cnt_alternate = process_history_file(log)
-            except ValueError as ex:
-                e = ex
+    executor = None
+    jobs = min(jobs, os.cpu_count() or 1)
+    if jobs > 1:
+        # History files are independent, so convert them in worker processes
+        # and send the resulting records from here
+        DebugPrint(4, "Converting history files with %d processes" % jobs)
+        # Only imported here to keep it out of the startup of serial runs
+        import concurrent.futures
+        import multiprocessing
+        # The workers need the probe configuration and the module state set
+        # up at runtime (config.Config, g_probe_config, min_start_time), which
+        # they only inherit when forked; spawn and forkserver (the Linux
+        # default from Python 3.14) would start them without it
+        pool_args = {'max_workers': jobs}
+        if sys.version_info >= (3, 7):
+            pool_args['mp_context'] = multiprocessing.get_context("fork")
+        executor = concurrent.futures.ProcessPoolExecutor(**pool_args)
+        results = convert_history_files(executor, valid_logfiles(), 2 * jobs)
+    else:
+        results = map(read_history_file_checked, valid_logfiles())
+
+    try:
+        for log, history, e in results:
+            if e:
                 DebugPrint(1, "Failed to parse log file: %s\nError was: %s" % (log, e))
                 cnt_submit, cnt_found, cnt_alternate = 0, 0, 0
+            else:
+                cnt_submit, cnt_found, cnt_alternate = send_history_records(*history)
 
             if not e and cnt_submit + cnt_alternate == cnt_found and (cnt_submit > 0 or cnt_alternate > 0):
                 DebugPrint(5, "Processed %i ClassAds from file %s" % (cnt_submit, log))
@@ -384,8 +548,9 @@ def process_history_dirs(dirs):
             submit_count += cnt_submit
             found_count += cnt_found
             alternate_count += cnt_alternate
-        else:
-            DebugPrint(2, "Ignoring history file with invalid name: %s" % log)
+    finally:
+        if executor:
+            executor.shutdown()
 
     DebugPrint(2, "Number of logfiles processed: %d" % logs_found)
     DebugPrint(2, "Number of logfiles with errors: %d" % logfile_errors)
@@ -394,25 +559,85 @@ def process_history_dirs(dirs):
     DebugPrint(2, "Number of usage records found: %d" % found_count)
     send_alternate_records(g_alternate_records)
 
-def process_history_file(logfile):
+def read_history_file_checked(logfile):
+    """
+    Wrapper around read_history_file for use with map(); returns
+    (logfile, read_history_file result, None) or (logfile, None, exception)
+    if the file could not be parsed.
+    """
+    try:
+        return logfile, read_history_file(logfile), None
+    except ValueError as e:
+        return logfile, None, e
+
+def read_history_files_checked(logfiles):
+    """
+    Run read_history_file_checked on a chunk of history files in a worker
+    process; returns the list of results.
+    """
+    return [read_history_file_checked(logfile) for logfile in logfiles]
 
-    count_alternate = 0
-    count_submit = 0
+def convert_history_files(executor, logfiles, max_pending):
+    """
+    Convert history files in the executor's worker processes, yielding the
+    read_history_file_checked results as they finish.  At most `max_pending`
+    chunks of history_file_chunksize files are submitted at a time, so the
+    converted records don't pile up faster than they can be sent.
+    """
+    import concurrent.futures
+    logfiles = iter(logfiles)
+    pending = set()
+    while True:
+        while len(pending) < max_pending:
+            chunk = list(itertools.islice(logfiles, history_file_chunksize))
+            if not chunk:
+                break
+            pending.add(executor.submit(read_history_files_checked, chunk))
+        if not pending:
+            return
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            yield from future.result()
+
+def read_history_file(logfile):
+    """
+    Convert the ClassAds in a history file to usage records without sending
+    them, so that it can run in a worker process.  Returns
+    (count_ignored, count_found, records, alternate_records) where
+    count_ignored is the number of JobAds that are deliberately not reported
+    (e.g. condor_dagman jobs) and are counted as submitted, and
+    alternate_records have a probe name other than the configured one.
+    """
+    count_ignored = 0
     count_found = 0
+    records = []
+    alternate_records = []
     try:
-        fd = open(logfile, 'r')
-    except IOError as ie:
+        fd = os.open(logfile, os.O_RDONLY)
+    except OSError as ie:
         DebugPrint(2, "Cannot process %s: (errno=%d) %s" % (logfile, ie.errno,
             ie.strerror))
-        return 0, 0, 0
+        return 0, 0, records, alternate_records
+    try:
+        classads = history_file_classads(fd)
+    finally:
+        os.close(fd)
     added_transient = False
+    expected_probe = GratiaCore.Config.get_ProbeName()
 
-    for classad in fd_to_classad(fd):
+    for classad in (add_unique_id(ad) for ad in classads):
         count_found += 1
         if not classad:
             DebugPrint(5, "Ignoring empty classad from file: %s" % logfile)
             continue
 
+        completion_date = get_completion_date(classad)
+        if completion_date < min_start_time:
+            DebugPrint(2, "Ignoring too-old job: %s (job age: %s, oldest " \
+                "acceptable age: %d)" % (str(classad.get("ClusterId", "Unknown")),
+                str(completion_date), min_start_time))
+            continue
+
         if not added_transient:
             classad['logfile'] = str(logfile)
             added_transient = True
@@ -424,49 +649,123 @@ def process_history_file(logfile):
             raise
         except IgnoreClassadException as e:
             DebugPrint(3, "Ignoring ClassAd: %s" % str(e))
-            count_submit += 1
+            count_ignored += 1
             continue
         except Exception as e:
             DebugPrint(2, "Exception while converting the ClassAd to a JUR: %s" % str(e))
             continue
 
-        enteredStatus = classad.get('EnteredCurrentStatus', 0)
-        if classad.get('CompletionDate', 0) == 0:
-            classad['CompletionDate'] = enteredStatus
+        if r.GetProbeName() != expected_probe:
+            alternate_records.append(r)
+        else:
+            records.append(r)
 
-        if classad.get('CompletionDate', min_start_time) < min_start_time:
-            DebugPrint(2, "Ignoring too-old job: %s (job age: %s, oldest " \
-                "acceptable age: %d)" % (str(classad.get("ClusterId", "Unknown")),
-                str(classad.get('CompletionDate', 'MISSING')), min_start_time))
-            continue
+    return count_ignored, count_found, records, alternate_records
 
-        if r.GetProbeName() != GratiaCore.Config.get_ProbeName():
-            count_alternate += 1
-            alt_info = g_alternate_records.setdefault((r.GetProbeName(), r.GetSiteName()), [])
-            alt_info.append(r)
-            continue
+def get_completion_date(classad):
+    """
+    Return the CompletionDate of a JobAd, falling back to EnteredCurrentStatus
+    for jobs that never completed (e.g. removed jobs) or 0 if neither is set
+    """
+    completion_date = classad.get('CompletionDate', 0)
+    if completion_date == 0:
+        completion_date = classad.get('EnteredCurrentStatus', 0)
+    return completion_date
+
+def send_history_records(count_ignored, count_found, records, alternate_records):
+    """
+    Send the records returned by read_history_file and set aside the
+    alternate probe name records.  Returns (count_submit, count_found,
+    count_alternate), where count_submit includes the count_ignored JobAds.
+    """
+    count_submit = count_ignored
+    for r in alternate_records:
+        alt_info = g_alternate_records.setdefault((r.GetProbeName(), r.GetSiteName()), [])
+        alt_info.append(r)
 
+    for r in records:
         response = GratiaCore.Send(r)
         if response[:2] == 'OK':
             count_submit += 1
 
-    return count_submit, count_found, count_alternate
+    return count_submit, count_found, len(alternate_records)
+
+def history_file_classads(fd):
+    """
+    Parse the ClassAds in a history file, given an open file descriptor, with
+    the C++ ClassAd parser rather than line by line in fd_to_classad.  The
+    file is read with os.read() calls sized from fstat() instead of through a
+    file object; per-job history files are small, so this is usually a
+    single read.
+    """
+    read_size = max(os.fstat(fd).st_size, history_file_min_read_size)
+    chunks = []
+    while True:
+        chunk = os.read(fd, read_size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return classadLib.parseAds(b''.join(chunks).decode('utf-8'))
 
 def process_condor_history(start_time=None, end_time=None):
-    hist_command = None
+    if GratiaCore.Config.getConfigAttribute("UseScheddHistoryQuery") != "1":
+        process_condor_history_command(start_time, end_time)
+        return
+
+    # The schedd's history helper returns at most HISTORY_HELPER_MAX_HISTORY
+    # ads per query, so this is only used when explicitly enabled
+    constraint = None
     if start_time is not None and end_time is not None:
-        hist_command = "condor_history -l -constraint " \
-                       "'((JobCurrentStartDate > %s) && (JobCurrentStartDate " \
-                       "< %s))'" % (start_time, end_time) 
-    else:
-        hist_command = "condor_history -l"
-    DebugPrint(-1, "RUNNING: %s" % hist_command)
-    fd = os.popen(hist_command)
-    submit_count, found_count, alternate_count = process_history_fd(fd)
-    if fd.close():
+        constraint = classadLib.ExprTree("(JobCurrentStartDate > %s) && "
+                                         "(JobCurrentStartDate < %s)" % (start_time, end_time))
+    DebugPrint(-1, "RUNNING: schedd history query with constraint: %s" % constraint)
+    # Pick up CONDOR_CONFIG from setup_environment()
+    htcondor.reload_config()
+    try:
+        history = htcondor.Schedd().history(constraint, [])
+        submit_count, found_count, alternate_count = \
+            process_history_ads((add_unique_id(classad) for classad in history), "schedd history")
+    except RuntimeError as e:
+        DebugPrint(-1, "condor_meter --history ERROR: Schedd history query " \
+                       "failed: %s" % e)
+        submit_count, found_count, alternate_count = 0, 0, 0
+
+    max_history = int(htcondor.param.get("HISTORY_HELPER_MAX_HISTORY", 10000))
+    if found_count >= max_history:
+        DebugPrint(-1, "condor_meter --history WARNING: Schedd history query " \
+                       "returned %d ads, the HISTORY_HELPER_MAX_HISTORY limit; " \
+                       "older jobs may be missing.  Set UseScheddHistoryQuery=\"0\" " \
+                       "to read them with condor_history." % found_count)
+
+    report_condor_history(submit_count, found_count, alternate_count)
+
+def process_condor_history_command(start_time=None, end_time=None):
+    hist_command = ["condor_history", "-l"]
+    if start_time is not None and end_time is not None:
+        hist_command += ["-constraint",
+                         "((JobCurrentStartDate > %s) && (JobCurrentStartDate "
+                         "< %s))" % (start_time, end_time)]
+    DebugPrint(-1, "RUNNING: %s" % " ".join(hist_command))
+    # Run condor_history directly (no intermediate shell) and read its
+    # output through a large buffer; `condor_history -l` can be huge.
+    try:
+        proc = subprocess.Popen(hist_command, stdout=subprocess.PIPE,
+                                bufsize=history_file_buffer_size,
+                                universal_newlines=True)
+    except OSError as e:
         DebugPrint(-1, "condor_meter --history ERROR: Call to condor_history " \
-                       "failed: %s" % hist_command)
+                       "failed: %s: %s" % (" ".join(hist_command), e))
+        report_condor_history(0, 0, 0)
+        return
+    with proc.stdout as fd:
+        submit_count, found_count, alternate_count = process_history_fd(fd)
+    if proc.wait():
+        DebugPrint(-1, "condor_meter --history ERROR: Call to condor_history " \
+                       "failed: %s" % " ".join(hist_command))
+
+    report_condor_history(submit_count, found_count, alternate_count)
 
+def report_condor_history(submit_count, found_count, alternate_count):
     DebugPrint(-1, "condor_meter --history: Usage records submitted: " \
                    "%d" % submit_count)
     DebugPrint(-1, "condor_meter --history: Usage records found: " \
@@ -477,17 +776,32 @@ def process_condor_history(start_time=None, end_time=None):
 
 def process_history_fd(fd):
     """
-    Process the job history from a file descriptor.  The difference between
-    this and process_history_file is that Gratia doesn't have any transient
-    files it will attempt to cleanup afterward.
+    Process the job history from a file descriptor.  Unlike history files
+    converted by read_history_file, the JobAds have no transient logfile
+    for Gratia to clean up afterward.
+    """
+    return process_history_ads(fd_to_classad(fd), fd.name)
+
+def process_history_ads(classads, source):
+    """
+    Process an iterable of job history ClassAds, e.g. from condor_history
+    output or a schedd history query.  `source` is only used for logging.
     """
     count_submit = 0
     count_found = 0
     count_alternate = 0
-    for classad in fd_to_classad(fd):
+    expected_site = GratiaCore.Config.get_SiteName()
+    for classad in classads:
         count_found += 1
         if not classad:
-            DebugPrint(5, "Ignoring empty classad from file: %s" % fd.name)
+            DebugPrint(5, "Ignoring empty classad from %s" % source)
+            continue
+
+        completion_date = get_completion_date(classad)
+        if completion_date < min_start_time:
+            DebugPrint(2, "Ignoring too-old job: %s (job age: %s, oldest " \
+                "acceptable age: %d)" % (str(classad.get("ClusterId", "Unknown")),
+                str(completion_date), min_start_time))
             continue
 
         try:
@@ -504,17 +818,7 @@ def process_history_fd(fd):
             DebugPrint(2, "Exception while converting the ClassAd to a JUR: %s" % str(e))
             continue
 
-        enteredStatus = classad.get('EnteredCurrentStatus', 0)
-        if classad.get('CompletionDate', 0) == 0:
-            classad['CompletionDate'] = enteredStatus
-
-        if classad.get('CompletionDate', min_start_time) < min_start_time:
-            DebugPrint(2, "Ignoring too-old job: %s (job age: %s, oldest " \
-                "acceptable age: %d)" % (str(classad.get("ClusterId", "Unknown")),
-                str(classad.get('CompletionDate', 'MISSING')), min_start_time))
-            continue
-
-        if r.GetSiteName() != GratiaCore.Config.get_SiteName():
+        if r.GetSiteName() != expected_site:
             count_alternate += 1
             alt_info = g_alternate_records.setdefault((r.GetProbeName(), r.GetSiteName()), [])
             alt_info.append(r)
@@ -527,18 +831,39 @@ def process_history_fd(fd):
     return count_submit, count_found, count_alternate
 
 def setIfExists(func, classad, attr, comment=None, setstr=False):
-    if attr in classad:
-        val = classad[attr]
-        if setstr:
-            val = str(val)
-        if not comment:
-            func(val)
-        else:
-            func(val, comment)
-        return True
-    return False
+    val = classad.get(attr)
+    if val is None:
+        return False
+    if setstr:
+        val = str(val)
+    if not comment:
+        func(val)
+    else:
+        func(val, comment)
+    return True
+
+def apply_mappings(r, classad, mappings):
+    """
+    Set usage record fields from JobAd attributes according to a table of
+    (UsageRecord method, attributes, description, setstr) entries, such as
+    JOB_IDENTITY_ATTRS.  The first attribute present in the JobAd is used.
+    """
+    for method, attrs, comment, setstr in mappings:
+        func = getattr(r, method)
+        for attr in attrs:
+            if setIfExists(func, classad, attr, comment, setstr):
+                break
+
+def apply_additional_info(r, classad, mappings):
+    """
+    Add AdditionalInfo to a usage record for each (name, attribute) entry of a
+    table such as PEGASUS_INFO_ATTRS whose attribute is present in the JobAd.
+    """
+    for name, attr in mappings:
+        val = classad.get(attr)
+        if val is not None:
+            r.AdditionalInfo(name, val)
 
-cream_re = re.compile("https://([A-Za-z-.0-9]+):(\d+)/ce-cream/services/CREAM2\s+(\S+)\s+\S+")
 def cream_match(match, desired):
     """
     CREAM matches are a bit different.  The desired CE looks like this:
@@ -547,13 +872,17 @@ def cream_match(match, desired):
         https://llrcream.in2p3.fr:8443/ce-cream/services/CREAM2 pbs cms
     So "normal" matching doesn't work, and we match using this function.
     """
-    m = cream_re.match(match)
-    if not m:
+    fields = match.split()
+    if len(fields) < 3:
+        return False
+    url = urlsplit(fields[0])
+    if url.scheme != 'https' or url.path != '/ce-cream/services/CREAM2':
+        return False
+    # Not url.hostname, which is lower-cased
+    hostname, _, port = url.netloc.partition(':')
+    if not hostname or not port.isdigit():
         return False
-    hostname, port, jm = m.groups()
-    match2 = "%s:%s/cream-%s" % (hostname, port, jm)
-    match2 = match2.strip()
-    return match2 == desired
+    return "%s:%s/cream-%s" % (hostname, port, fields[1]) == desired
 
 
 def get_classad_resource_name(classad):
@@ -564,7 +893,13 @@ def get_classad_resource_name(classad):
     return None
 
 
-split_re = re.compile(",\s*")
+def split_host_list(hosts):
+    """
+    Return the set of host names in a comma-separated list such as DESIRED_SEs
+    """
+    return {host.strip() for host in hosts.split(',')}
+
+
 def determine_host_description(classad):
     """
     Determine the value of the host description field.
@@ -589,247 +924,235 @@ def determine_host_description(classad):
     if ('DESIRED_SEs' not in classad) or ('MATCH_GLIDEIN_SEs' not in classad):
         return host_descr
     match_se = classad['MATCH_GLIDEIN_SEs'].strip()
-    for desired_se in split_re.split(classad['DESIRED_SEs']):
-        desired_se = desired_se.strip()
-        if match_se == desired_se:
-            return host_descr
+    if match_se in split_host_list(classad['DESIRED_SEs']):
+        return host_descr
 
     # Then check for CE-based matching.
     if ('DESIRED_Gatekeepers' not in classad) or \
                 ('MATCH_GLIDEIN_Gatekeeper' not in classad):
         return host_descr
     match_ce = classad['MATCH_GLIDEIN_Gatekeeper']
-    for desired_ce in split_re.split(classad['DESIRED_Gatekeepers']):
-        desired_ce = desired_ce.strip()
-        if match_ce == desired_ce or cream_match(match_ce, desired_ce):
+    desired_ces = split_host_list(classad['DESIRED_Gatekeepers'])
+    if match_ce in desired_ces:
+        return host_descr
+    for desired_ce in desired_ces:
+        if cream_match(match_ce, desired_ce):
             return host_descr
 
     # If neither CE nor SE matched, it must be an overflow job.
     return host_descr + "-overflow"
 
-global_job_id_re = re.compile("(.*)\#\d+\.?\d*\#.*")
-campus_factory_usage = re.compile("(.*)\-CF$")
-campus_flock_usage = re.compile("(.*)\-Flock$")
-def classadToJUR(classad):
-    def invalidDuration(classad, field):
-        """
-        Local function to check duration and make sure it's reasonable.  Values obtained
-        from HTCondor team and discussed in SOFTWARE-1132
-        """
-        if field not in ['RemoteSysCpu', 'RemoteUserCpu']:
-            return False      
-        if classad[field] < 2000000000:
-            return False
-        slot_ratio = classad[field] / (float(classad['CumulativeSlotTime']) + 1)
-        if slot_ratio > 1000:
-            return True
+extra_attributes_split_re = re.compile(r'[,\s]+')
+def get_extra_attributes():
+    """
+    Return the list of arbitrary JobAd attributes to report (SOFTWARE-2714),
+    parsed from the ExtraAttributes config on first use
+    """
+    global g_extra_attributes
+    if g_extra_attributes is None:
+        extra_attrs = str(GratiaCore.Config.getConfigAttribute("ExtraAttributes"))
+        DebugPrint(5, "Arbitrary Job Attributes: %s" % extra_attrs)
+        g_extra_attributes = [attr for attr in extra_attributes_split_re.split(extra_attrs) if attr]
+        DebugPrint(5, "Arbitrary attribute list: %s" % g_extra_attributes)
+    return g_extra_attributes
+
+def get_submit_host(global_job_id):
+    """
+    Return the submit host from a GlobalJobId of the form
+    <submit host>#<cluster>.<proc>#<timestamp>, or None if it is not in that form
+    """
+    submit_host, _, rest = global_job_id.partition('#')
+    job_id, sep, _ = rest.partition('#')
+    if sep and job_id[:1].isdigit() and job_id.replace('.', '', 1).isdigit():
+        return submit_host
+    return None
+
+# Campus factory and flocking resource names, matched in a single pass
+campus_usage_re = re.compile(r"(?P<factory>-CF)$|(?P<flock>-Flock)$")
+def invalidDuration(classad, cpu_time):
+    """
+    Check a remote CPU time and make sure it's reasonable.  Values obtained
+    from HTCondor team and discussed in SOFTWARE-1132
+    """
+    if cpu_time < 2000000000:
         return False
-           
+    slot_ratio = cpu_time / (float(classad['CumulativeSlotTime']) + 1)
+    return slot_ratio > 1000
 
+def classadToJUR(classad):
     if 'ClusterId' not in classad:
         DebugPrint(2, "No data passed to classadToJUR: %s" % str(classad))
         raise Exception("No data passed to classadToJUR: %s" % str(classad))
-    DebugPrint(5, "Creating JUR for %s" % classad['ClusterId'])
+    if debug_enabled(5):
+        DebugPrint(5, "Creating JUR for %s" % classad['ClusterId'])
 
-    cmd = os.path.split(classad.get("Cmd", "foo"))[-1]
+    cmd = classad.get("Cmd", "foo").rpartition("/")[-1]
     if cmd == "condor_dagman":
-        if 'logfile' in classad:
-            DebugPrint(1, 'Deleting transient condor_dagman input file: '+classad["logfile"])
-            file_utils.RemoveFile(classad["logfile"])
+        logfile = classad.get('logfile')
+        if logfile is not None:
+            DebugPrint(1, 'Deleting transient condor_dagman input file: '+logfile)
+            file_utils.RemoveFile(logfile)
         raise IgnoreClassadException("Ignoring classad for condor_dagman monitor.")
 
+    resource_name = get_classad_resource_name(classad)
     resource_type = "Batch"
     if classad.get("GridMonitorJob", False):
         resource_type = "GridMonitor"
-    elif get_classad_resource_name(classad) is not None:
+    elif resource_name is not None:
         resource_type = 'BatchPilot'
     r = Gratia.UsageRecord(resource_type)
 
     r.GlobalJobId(classad.get("UniqGlobalJobId", ""))
 
-    job_id = 'Unknown'
-    if "ProcId" in classad and int(classad["ProcId"]) > 0:
-        r.LocalJobId("%s.%s" % (classad["ClusterId"], classad["ProcId"]))
-        job_id = "%s.%s" % (classad["ClusterId"], classad["ProcId"])
+    cluster_id = classad['ClusterId']
+    proc_id = classad.get("ProcId")
+    if proc_id is not None and int(proc_id) > 0:
+        job_id = "%s.%s" % (cluster_id, proc_id)
+        r.LocalJobId(job_id)
     else:
-        r.LocalJobId(str(classad['ClusterId']))
-        job_id = classad['ClusterId']
+        r.LocalJobId(str(cluster_id))
+        job_id = cluster_id
 
     # I don't think ProcessId was ever correct - used to take the UDP port 
     # from the LastClaimId?
 
-    # a pre-routed job's AuthToken attrs are copied with "orig_" prefix
-    # in the routed job (SOFTWARE-5185, HTCONDOR-1071)
-    setIfExists(r.LocalUserId, classad, "Owner")
-    setIfExists(r.GlobalUsername, classad, "User")
-    setIfExists(r.DN, classad, 'x509userproxysubject') or \
-    setIfExists(r.DN, classad, 'orig_AuthTokenSubject')
-    setIfExists(r.VOName, classad, 'x509UserProxyFirstFQAN') or \
-    setIfExists(r.VOName, classad, 'orig_AuthTokenIssuer')  # VO info for SciToken
-    setIfExists(r.ReportableVOName, classad, 'x509UserProxyVOName') or \
-    setIfExists(r.ReportableVOName, classad, 'orig_AuthTokenIssuer')
-
-    if 'GlobalJobId' in classad:
-        r.JobName(classad["GlobalJobId"])
-        job_id = classad["GlobalJobId"]
-        m = global_job_id_re.match(classad['GlobalJobId'])
-        if m:
-            submit_host = m.groups()[0]
+    apply_mappings(r, classad, JOB_IDENTITY_ATTRS)
+
+    global_job_id = classad.get('GlobalJobId')
+    if global_job_id is not None:
+        r.JobName(global_job_id)
+        job_id = global_job_id
+        submit_host = get_submit_host(global_job_id)
+        if submit_host is not None:
             r.MachineName(submit_host)
             r.SubmitHost(submit_host)
 
-    setIfExists(r.Status, classad, 'ExitStatus', "Condor Exit Status")
-
-    setIfExists(r.WallDuration, classad, 'RemoteWallClockTime', "Was entered in seconds")
-
-    if 'RemoteUserCpu' in classad:
-        if  invalidDuration(classad, 'RemoteUserCpu'):
-            DebugPrint(1, 
-                       "WARNING: INVALID DATA: Record for %s has invalid " \
-                       "RemoteUserCpu time %s, replacing value with " \
-                       "0\n" % (job_id, classad['RemoteUserCpu']))
-            classad['RemoteUserCpu'] = 0
-        r.TimeDuration(classad['RemoteUserCpu'], "RemoteUserCpu")
-    else:
-        classad['RemoteUserCpu'] = 0
-
-    if 'LocalUserCpu' in classad:
-        r.TimeDuration(classad['LocalUserCpu'], 'LocalUserCpu')
-    else:
-        classad['LocalUserCpu'] = 0
-
-    if 'RemoteSysCpu' in classad:
-        if  invalidDuration(classad, 'RemoteSysCpu'):
-            DebugPrint(1, 
-                       "WARNING: INVALID DATA: Record for %s has invalid " \
-                       "RemoteSysCpu time %s, replacing value with " \
-                       "0\n" % (job_id, classad['RemoteSysCpu']))                       
-            classad['RemoteSysCpu'] = 0
-        r.TimeDuration(classad['RemoteSysCpu'], 'RemoteSysCpu')
-    else:
-        classad['RemoteSysCpu'] = 0
-
-    if 'LocalSysCpu' in classad:
-        r.TimeDuration(classad['LocalSysCpu'], 'LocalSysCpu')
-    else:
-        classad['LocalSysCpu'] = 0
-
-    setIfExists(r.TimeDuration, classad, 'CumulativeSuspensionTime', 'CumulativeSuspensionTime')
-    setIfExists(r.TimeDuration, classad, 'CommittedSuspensionTime', 'CommittedSuspensionTime')
-    setIfExists(r.TimeDuration, classad, 'CommittedTime', 'CommittedTime')
-
-    classad['SysCpuTotal'] = classad['RemoteSysCpu'] + classad['LocalSysCpu']
-    r.CpuDuration(classad['SysCpuTotal'], "system", "Was entered in seconds")
-
-    classad['UserCpuTotal'] = classad['RemoteUserCpu'] + classad['LocalUserCpu']
-    r.CpuDuration(classad['UserCpuTotal'], "user", "Was entered in seconds")
+    apply_mappings(r, classad, JOB_STATUS_ATTRS)
 
-    if 'CompletionDate' in classad and classad['CompletionDate'] > 0:
-        if hasattr(classad, 'eval'):
-            DebugPrint(5, "Current completion time: %s" % classad.eval('CompletionDate'))
-            r.EndTime(classad.eval('CompletionDate'), "Was entered in seconds")
+    cpu_times = {}
+    for attr, check_duration in CPU_TIME_ATTRS:
+        cpu_time = classad.get(attr)
+        if cpu_time is None:
+            cpu_time = classad[attr] = 0
         else:
-            DebugPrint(5, "Current completion time: %s" % classad['CompletionDate'])
-            r.EndTime(classad['CompletionDate'], "Was entered in seconds")
-
-    setIfExists(r.StartTime, classad, 'JobStartDate', "Was entered in seconds")
-
-    setIfExists(r.QueueTime, classad, 'QDate', "Was entered in seconds")
-
-    if 'LastRemoteHost' in classad:
-        host = classad['LastRemoteHost'].split("@")[-1]
+            if check_duration and invalidDuration(classad, cpu_time):
+                DebugPrint(1, 
+                           "WARNING: INVALID DATA: Record for %s has invalid " \
+                           "%s time %s, replacing value with " \
+                           "0\n" % (job_id, attr, cpu_time))
+                cpu_time = classad[attr] = 0
+            r.TimeDuration(cpu_time, attr)
+        cpu_times[attr] = cpu_time
+
+    apply_mappings(r, classad, JOB_SUSPENSION_ATTRS)
+
+    sys_cpu_total = classad['SysCpuTotal'] = cpu_times['RemoteSysCpu'] + cpu_times['LocalSysCpu']
+    r.CpuDuration(sys_cpu_total, "system", "Was entered in seconds")
+
+    user_cpu_total = classad['UserCpuTotal'] = cpu_times['RemoteUserCpu'] + cpu_times['LocalUserCpu']
+    r.CpuDuration(user_cpu_total, "user", "Was entered in seconds")
+
+    completion_date = classad.get('CompletionDate')
+    if completion_date is not None and completion_date > 0:
+        if CLASSAD_HAS_EVAL:
+            completion_date = classad.eval('CompletionDate')
+        if debug_enabled(5):
+            DebugPrint(5, "Current completion time: %s" % completion_date)
+        r.EndTime(completion_date, "Was entered in seconds")
+
+    apply_mappings(r, classad, JOB_TIME_ATTRS)
+
+    last_remote_host = classad.get('LastRemoteHost')
+    if last_remote_host is not None:
+        host = last_remote_host.split("@")[-1]
         host_descr = determine_host_description(classad)
         if host_descr:
             r.Host(host, True, host_descr)
         else:
             r.Host(host, True)
 
-    setIfExists(r.Queue, classad, "JobUniverse", "Condor's JobUniverse field", setstr=True)
-    setIfExists(r.NodeCount, classad, 'MaxHosts', "max")
+    apply_mappings(r, classad, JOB_QUEUE_ATTRS)
 
     ########################################################################################
     ########################################################################################
     # Code added to send to arbitrary Ads SOFTWARE-2714
-    ArbitraryJobAttrs = str(GratiaCore.Config.getConfigAttribute("ExtraAttributes"))
-    DebugPrint(5, "Arbitrary Job Attributes: %s" % ArbitraryJobAttrs)
-    ArbitraryAttrslist = re.split(r'[,\s]+', ArbitraryJobAttrs)
-    DebugPrint(0, "ArbritaryList: %s" % ArbitraryAttrslist)
-    for arbitraryAttr in ArbitraryAttrslist:
+    for arbitraryAttr in get_extra_attributes():
         if arbitraryAttr in classad:
-            DebugPrint(5, "Arbitrary attribute: %s found with value %s" % (arbitraryAttr, classad.eval(arbitraryAttr)))
-            r.AdditionalInfo(arbitraryAttr, classad.eval(arbitraryAttr))
+            value = classad.eval(arbitraryAttr)
+            if debug_enabled(5):
+                DebugPrint(5, "Arbitrary attribute: %s found with value %s" % (arbitraryAttr, value))
+            r.AdditionalInfo(arbitraryAttr, value)
     ########################################################################################
     r.Processors(get_num_procs(classad), metric="max")
 
     # Set the Gpus
     # There are many different spellings of requestgpus, RequestGpus, RequestGpus
-    # So eval, which is case insensitive (from my testing)
+    # Attribute lookups and eval are both case insensitive (from my testing)
     try:
-        r.GPUs(int(classad.eval('RequestGpus')), metric="max")
+        r.GPUs(get_int_attr(classad, 'RequestGpus'), metric="max")
     except:
         # No GPUs, no problem
         # Or error converting to int, then just ignore GPUs
         pass
 
-    if 'MyType' in classad:
-        r.AdditionalInfo("CondorMyType", classad['MyType'])
+    apply_additional_info(r, classad, JOB_INFO_ATTRS)
 
-    if 'AccountingGroup' in classad:
-        r.AdditionalInfo("AccountingGroup", classad['AccountingGroup'])
-
-    if 'ExitBySignal' in classad:
-        if classad['ExitBySignal']:
+    exit_by_signal = classad.get('ExitBySignal')
+    if exit_by_signal is not None:
+        if exit_by_signal:
             # Gratia expects lower-case; python produces "True".
             r.AdditionalInfo('ExitBySignal', 'true')
         else:
             r.AdditionalInfo('ExitBySignal', 'false')
-    if 'ExitSignal' in classad:
-        r.AdditionalInfo("ExitSignal", classad['ExitSignal'])
-    if 'ExitCode' in classad:
-        r.AdditionalInfo("ExitCode", classad['ExitCode'])
-    if 'JobStatus' in classad:
-        r.AdditionalInfo("condor.JobStatus", classad['JobStatus'])
-    if 'GratiaJobOrigin' in classad:
-        if classad['GratiaJobOrigin'] == "GRAM":
+    apply_additional_info(r, classad, JOB_EXIT_INFO_ATTRS)
+    job_origin = classad.get('GratiaJobOrigin')
+    if job_origin is not None:
+        if job_origin == "GRAM":
             r.Grid("OSG", "GratiaJobOrigin = GRAM")
         else:
             r.Grid("Local", "GratiaJobOrigin not GRAM")
 
-    resource_name = get_classad_resource_name(classad)
     if resource_name is not None:
-        if campus_factory_usage.search(resource_name):
-            r.Grid("Campus", "Campus Factory Usage")
-        elif campus_flock_usage.search(resource_name):
-            r.Grid("Campus", "Campus Flocking Usage")
-        elif resource_name == "Local Job":
+        if resource_name == "Local Job":
             r.Grid("Local", "Local execution based on ResourceName")
+        else:
+            m = campus_usage_re.search(resource_name)
+            if m is not None:
+                if m.lastgroup == 'factory':
+                    r.Grid("Campus", "Campus Factory Usage")
+                else:
+                    r.Grid("Campus", "Campus Flocking Usage")
 
-    if 'JobUniverse' in classad:
-        # scheduler and local universes are always considered to be local
-        if classad['JobUniverse'] == 7 or classad['JobUniverse'] == 12:
-            r.Grid("Local", "Local execution based on job universe")
+    # scheduler and local universes are always considered to be local
+    if classad.get('JobUniverse') in (7, 12):
+        r.Grid("Local", "Local execution based on job universe")
 
     # Jobs that are routed to other jobs should be considered local
     if 'RoutedToJobId' in classad:
         r.Grid("Local", "Source of routed job")
 
-    if 'logfile' in classad:
-        r.AddTransientInputFile(classad["logfile"])
+    logfile = classad.get('logfile')
+    if logfile is not None:
+        r.AddTransientInputFile(logfile)
 
     setIfExists(r.ProjectName, classad, 'ProjectName', 'As specified in Condor submit file', True)
 
-    if 'GratiaSiteName' in classad and hasattr(classad, 'lookup'):
+    if CLASSAD_HAS_LOOKUP and 'GratiaSiteName' in classad:
         evaluated = classad.lookup('GratiaSiteName').eval()
         if isinstance(evaluated, bytes):
+            evaluated = evaluated.decode()
+        if isinstance(evaluated, str):
             r.SiteName(evaluated)
-            r.ProbeName('%s-%s' % (r.GetProbeName(), evaluated))
+            r.ProbeName(f"{r.GetProbeName()}-{evaluated}")
 
     networkPhaseUnit = classad.get('RemoteWallClockTime', '')
+    # Scan the attribute names and only fetch and evaluate the Network* values
     total_network = 0
-    for attr, val in classad.items():
+    for attr in classad.keys():
         if attr.startswith("Network"):
-            total_network += val
+            val = classad[attr]
             r.Network(val, storageUnit='b', phaseUnit=networkPhaseUnit, metric=attr, description=attr)
+            total_network += val
     r.Network(total_network, storageUnit='b', phaseUnit=networkPhaseUnit, metric="total")
 
     if not setIfExists(r.ExecutePool, classad, 'LastRemotePool', "Pool Host"):
@@ -837,40 +1160,29 @@ def classadToJUR(classad):
             r.ExecutePool(host, "Pool Host from COLLECTOR_HOST")
 
     # Additional Pegasus attributes
-    if 'pegasus_root_wf_uuid' in classad:
-        r.AdditionalInfo("PegasusRootWFUUID", classad['pegasus_root_wf_uuid'])
-    if 'pegasus_wf_uuid' in classad:
-        r.AdditionalInfo("PegasusWFUUID", classad['pegasus_wf_uuid'])
-    if 'pegasus_version' in classad:
-        r.AdditionalInfo("PegasusVersion", classad['pegasus_version'])
-    if 'pegasus_wf_app' in classad:
-        r.AdditionalInfo("PegasusApp", classad['pegasus_wf_app'])
-    if 'pegasus_wf_xformation' in classad:
-        r.AdditionalInfo("PegasusWFXformation", classad['pegasus_wf_xformation'])
+    apply_additional_info(r, classad, PEGASUS_INFO_ATTRS)
 
     return r
 
-classad_bool_re = re.compile("^(\w{1,255}) = (true|True|TRUE|false|False|FALSE)$")
-classad_int_re = re.compile("^(\w{1,255}) = (-?\d{1,30})$")
-classad_double_re = re.compile("^(\w{1,255}) = ([+-]? *(?:\d{1,30}\.?\d{0,30}|\.\d{1,30})(?:[Ee][+-]?\d{1,30})?)$")
-classad_string_re = re.compile("^(\S+) = \"(.*)\"$")
-classad_catchall_re = re.compile("^(\S+) = (.*)$")
 def fd_to_classad(fd):
-    buffer = ''
+    buffer_lines = []
     for lineOrig in fd:
-        line = lineOrig.strip()
-        if not line:
-            yield add_unique_id(classadLib.parseOne(buffer))
-            buffer = ''
+        if lineOrig.isspace():
+            yield add_unique_id(classadLib.parseOne(''.join(buffer_lines)))
+            buffer_lines.clear()
         else:
-            buffer += lineOrig
+            buffer_lines.append(lineOrig)
 
-    yield add_unique_id(classadLib.parseOne(buffer))
+    if buffer_lines:
+        yield add_unique_id(classadLib.parseOne(''.join(buffer_lines)))
 
 def add_unique_id(classad):
-    if 'GlobalJobId' in classad:
-        classad['UniqGlobalJobId'] = 'condor.%s' % classad['GlobalJobId']
-        DebugPrint(6, "Unique ID: %s" % classad['UniqGlobalJobId'])
+    global_job_id = classad.get('GlobalJobId')
+    if global_job_id is not None:
+        unique_id = 'condor.%s' % global_job_id
+        classad['UniqGlobalJobId'] = unique_id
+        if debug_enabled(6):
+            DebugPrint(6, "Unique ID: %s" % unique_id)
     return classad
 
 def setup_environment():
@@ -887,156 +1199,172 @@ def setup_environment():
         DebugPrint(0, "Can't setup CONDOR_LOCATION and CONDOR_CONFIG, exiting")
         return False
         
-def htcondor_configured():
+def run_condor_config_val(binary, args):
     """
-    Make sure HTCondor is configured correctly for Gratia.   
-    """ 
-    try:
+    Run `binary` (condor_config_val or condor_ce_config_val) with the
+    arguments `args`, preferring the copy under CondorLocation and otherwise
+    searching $PATH.  Returns (return code, stripped stdout); the return code
+    is None if the binary could not be found.
+
+    Results are cached, so each distinct query forks at most once per run.
+    """
+    key = (binary,) + tuple(args)
+    if key not in g_condor_config_val_cache:
         path = GratiaCore.Config.getConfigAttribute("CondorLocation")
-        if g_probe_config is not None and 'htcondor-ce' in g_probe_config:
-          condor_config_binary = 'condor_ce_config_val'
+        condor_config_path = os.path.join(path, "bin", binary)
+        if not os.path.isfile(condor_config_path):
+            condor_config_path = shutil.which(binary)
+        if condor_config_path is None:
+            DebugPrint(4, 'Unable to find %s in CondorLocation or $PATH' % binary)
+            result = (None, '')
         else:
-          condor_config_binary = 'condor_config_val'
-        condor_config_path = os.path.join(path, "bin", condor_config_binary)
-
-        condor_config_val_args=['-schedd']
-        schedd_name = GratiaCore.Config.getConfigAttribute('CondorScheddName')
-        if schedd_name:
-            condor_config_val_args.extend(['-name', schedd_name])
-        condor_config_val_args.append('PER_JOB_HISTORY_DIR')
-
-        if (os.path.exists(condor_config_path) and 
-            os.path.isfile(condor_config_path)):
-            args = [condor_config_path] + condor_config_val_args
+            args = [condor_config_path] + list(args)
             DebugPrint(4, 'Running command to check condor config: ' \
                           + ' '.join(args))
             cmd = subprocess.Popen(args, stdout=subprocess.PIPE)
-        else:
-            # args needs to be string when shell=True
-            args = condor_config_binary + ' ' + ' '.join(condor_config_val_args)
-            DebugPrint(4, 'Running command to check condor config: ' + args)
-            cmd = subprocess.Popen(args, stdout=subprocess.PIPE, shell=True)
-        cmd_stdout = utils.bytes2str(cmd.communicate()[0])
-        # cmd_stdout contains the directory path, removing spaces
-        # It will always be a string even if returncode != 0 
-        cmd_stdout = cmd_stdout.strip()
-        if cmd.returncode != 0:
-            DebugPrint(-1, "WARNING: condor_config_val returned a non-zero " \
-                           "return code. Maybe the schedd is overloaded.")
-            return False
-        elif 'Not defined' in cmd_stdout:
-            DebugPrint(-1, "WARNING: PER_JOB_HISTORY_DIR not set in the default condor schedd " \
-                           "config. You may need to change or reload the condor configuration " \
-                           "or specify a different CondorScheddName in the Gratia config.")
-            return False
-        elif (not os.path.exists(cmd_stdout) or 
-              not os.path.isdir(cmd_stdout)):
-            DebugPrint(-1 , "WARNING: PER_JOB_HISTORY_DIR points to a " \
-                            "non-existent or invalid directory: " \
-                            "%s" % cmd_stdout)
-            return False
-        data_folder = GratiaCore.Config.getConfigAttribute('DataFolder')
-        if not os.path.samefile(cmd_stdout, data_folder):
-            DebugPrint(-1, "WARNING: PER_JOB_HISTORY_DIR (%s) and DataFolder "
-                           "setting (%s) do not match!" %(cmd_stdout, data_folder))
-            return False
-        return True
-    except subprocess.CalledProcessError:
-        DebugPrint(-1, "WARNING: Can't get information on PER_JOB_HISTORY_DIR, " \
-                       "condor_config_val returned non-zero exit code")
-    return False
+            # cmd_stdout will always be a string even if returncode != 0
+            cmd_stdout = utils.bytes2str(cmd.communicate()[0]).strip()
+            result = (cmd.returncode, cmd_stdout)
+        g_condor_config_val_cache[key] = result
+    return g_condor_config_val_cache[key]
+
+def htcondor_configured():
+    """
+    Make sure HTCondor is configured correctly for Gratia.   
+    """ 
+    if g_probe_config is not None and 'htcondor-ce' in g_probe_config:
+      condor_config_binary = 'condor_ce_config_val'
+    else:
+      condor_config_binary = 'condor_config_val'
+
+    condor_config_val_args=['-schedd']
+    schedd_name = GratiaCore.Config.getConfigAttribute('CondorScheddName')
+    if schedd_name:
+        condor_config_val_args.extend(['-name', schedd_name])
+    condor_config_val_args.append('PER_JOB_HISTORY_DIR')
+
+    # cmd_stdout contains the directory path, removing spaces
+    returncode, cmd_stdout = run_condor_config_val(condor_config_binary,
+                                                   condor_config_val_args)
+    if returncode != 0:
+        DebugPrint(-1, "WARNING: condor_config_val returned a non-zero " \
+                       "return code. Maybe the schedd is overloaded.")
+        return False
+    elif 'Not defined' in cmd_stdout:
+        DebugPrint(-1, "WARNING: PER_JOB_HISTORY_DIR not set in the default condor schedd " \
+                       "config. You may need to change or reload the condor configuration " \
+                       "or specify a different CondorScheddName in the Gratia config.")
+        return False
+    elif (not os.path.exists(cmd_stdout) or 
+          not os.path.isdir(cmd_stdout)):
+        DebugPrint(-1 , "WARNING: PER_JOB_HISTORY_DIR points to a " \
+                        "non-existent or invalid directory: " \
+                        "%s" % cmd_stdout)
+        return False
+    data_folder = GratiaCore.Config.getConfigAttribute('DataFolder')
+    if not os.path.samefile(cmd_stdout, data_folder):
+        DebugPrint(-1, "WARNING: PER_JOB_HISTORY_DIR (%s) and DataFolder "
+                       "setting (%s) do not match!" %(cmd_stdout, data_folder))
+        return False
+    return True
 
 
 def get_collector_host():
     """
     Query for COLLECTOR_HOST
     """
-    try:
-        path = GratiaCore.Config.getConfigAttribute("CondorLocation")
-        if g_probe_config is not None and 'htcondor-ce' in g_probe_config:
-          #condor_config_binary = 'condor_ce_config_val'
-          return None
-        else:
-          condor_config_binary = 'condor_config_val'
-        condor_config_path = os.path.join(path, "bin", condor_config_binary)
-        condor_config_val_args = ['COLLECTOR_HOST']
-
-        if (os.path.exists(condor_config_path) and
-            os.path.isfile(condor_config_path)):
-            args = [condor_config_path] + condor_config_val_args
-            cmd = subprocess.Popen(args, stdout=subprocess.PIPE)
-        else:
-            # args needs to be string when shell=True
-            args = condor_config_binary + ' ' + ' '.join(condor_config_val_args)
-            cmd = subprocess.Popen(args, stdout=subprocess.PIPE, shell=True)
-
-        cmd_stdout = utils.bytes2str(cmd.communicate()[0])
-        cmd_stdout = cmd_stdout.strip()
-        if cmd.returncode != 0:
-            DebugPrint(-1, "WARNING: condor_config_val COLLECTOR_HOST "
-                           "returned a non-zero return code. Maybe the "
-                           "condor_master is overloaded.")
-            return None
-        elif 'Not defined' in cmd_stdout:
-            DebugPrint(-1, "WARNING: COLLECTOR_HOST not set in the default "
-                           "condor master config. You may need to change or "
-                           "reload the condor configuration.")
-            return None
-
-        return cmd_stdout
-    except subprocess.CalledProcessError:
-        DebugPrint(-1, "WARNING: Can't get information on COLLECTOR_HOST, "
-                       "condor_config_val returned non-zero exit code")
+    if g_probe_config is not None and 'htcondor-ce' in g_probe_config:
+      #condor_config_binary = 'condor_ce_config_val'
+      return None
+
+    returncode, cmd_stdout = run_condor_config_val('condor_config_val',
+                                                   ['COLLECTOR_HOST'])
+    if returncode != 0:
+        DebugPrint(-1, "WARNING: condor_config_val COLLECTOR_HOST "
+                       "returned a non-zero return code. Maybe the "
+                       "condor_master is overloaded.")
+        return None
+    elif 'Not defined' in cmd_stdout:
+        DebugPrint(-1, "WARNING: COLLECTOR_HOST not set in the default "
+                       "condor master config. You may need to change or "
+                       "reload the condor configuration.")
         return None
 
+    return cmd_stdout
+
 
+collector_host_split_re = re.compile(r'[ ,]+')
+sinful_alias_re = re.compile(r'&alias=([^&>]+)')
 def get_collector_host_names() -> List[str]:
     """
     Parse one or more host name values from get_collector_host()
     """
     collector_host = get_collector_host()
-    hosts = []
     if not collector_host:
-        return hosts
-    for host in re.split(r'[ ,]+', collector_host.strip()):
+        return []
+    return list(parse_collector_host(collector_host))
+
+
+@functools.lru_cache(maxsize=4)
+def parse_collector_host(collector_host):
+    """
+    Return a tuple of the host names in a COLLECTOR_HOST value.  This is
+    needed for every JobAd without LastRemotePool, so the result is cached.
+    """
+    hosts = []
+    for host in collector_host_split_re.split(collector_host.strip()):
         if host.startswith("<"):
             # Looks like `host` is not a host, it is a <sinful> string.
             # Parse alias out of it to get the actual host:port
-            m = re.search(r'&alias=([^&>]+)', host)
+            m = sinful_alias_re.search(host)
             if m:
                 host = m.group(1)
             else:
                 continue
-        if ':' in host:  # `host` is a host:port but we just want the host
-            hosts.append(host.split(':')[0])
-        else:
-            hosts.append(host)
-    return hosts
+        # `host` may be a host:port but we just want the host
+        hosts.append(host.partition(':')[0])
+    return tuple(hosts)
 
 
 def send_alternate_records(gratia_info):
     """
     For any accumulated records with an alternate probe/site name, send in a sub-process.
+
+    Each probe/site is sent from a freshly forked child because sending
+    reconfigures the Gratia library for that probe/site.  Up to
+    max_alternate_procs children run at once, but never two for the same probe
+    name since they would share its outbox directory.
     """
     if not gratia_info:
         return
     GratiaCore.Disconnect()
-    for info, records in gratia_info.items():
-        pid = os.fork()
-        if pid == 0: # I am the child
-            try:
-                signal.alarm(5*60)
-                send_alternate_records_child(info, records)
-            except Exception as e:
-                DebugPrint(2, "Failed to send alternate records: %s" % str(e))
-                DebugPrintTraceback(2)
+    children = {}  # pid -> probe name
+    def wait_child():
+        try:
+            pid, _ = os.waitpid(-1, 0)
+        except ChildProcessError:
+            children.clear()
+            return
+        children.pop(pid, None)
+
+    try:
+        for info, records in gratia_info.items():
+            while len(children) >= max_alternate_procs or info[0] in children.values():
+                wait_child()
+            pid = os.fork()
+            if pid == 0: # I am the child
+                try:
+                    signal.alarm(5*60)
+                    send_alternate_records_child(info, records)
+                except Exception as e:
+                    DebugPrint(2, "Failed to send alternate records: %s" % str(e))
+                    DebugPrintTraceback(2)
+                    os._exit(0)
                 os._exit(0)
-            os._exit(0)
-        else: # I am parent
-            try:
-                os.waitpid(pid, 0)
-            except:
-                raise
+            children[pid] = info[0]
+    finally:
+        while children:
+            wait_child()
 
 
 def send_alternate_records_child(info, record_list):
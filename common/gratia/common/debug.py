@@ -73,6 +73,18 @@ def DebugPrint(level, *arg):
         sys.exit()
 
 
+def debug_enabled(level):
+    """Return True if DebugPrint(level, ...) would print or log the message, so that
+    callers can skip building messages that would be discarded
+    """
+    if __quiet__:
+        return False
+    config = getGratiaConfig()
+    if not config:
+        return False
+    return level < config.get_DebugLevel() or level < config.get_LogLevel()
+
+
 def LogFileName():
     """Return the name of the current log file. If there is no LogFileName set in the configuration
     a default yy-mm-dd.log is returned
@@ -7,10 +7,12 @@ rest of the system
 """
 
 import os
+import socket
 
 bundle_size = 0
 CurrentBundle = None
 RecordPid = os.getpid()
+HostFQDN = None
 collector__wantsUrlencodeRecords = 1
 
 estimatedServiceBacklog = 0
@@ -25,3 +27,20 @@ def RegisterEstimatedServiceBacklog(count):
     global estimatedServiceBacklog
     estimatedServiceBacklog = count
 
+def getHostFQDN():
+    """Return the fully qualified host name used in record identities.
+    socket.getfqdn() may block on DNS, so it is only looked up once.
+    """
+    global HostFQDN
+    if HostFQDN is None:
+        HostFQDN = socket.getfqdn()
+    return HostFQDN
+
+def _resetRecordPid():
+    # Records created in a forked child must not reuse the parent's pid
+    global RecordPid
+    RecordPid = os.getpid()
+
+if hasattr(os, 'register_at_fork'):  # Python >= 3.7
+    os.register_at_fork(after_in_child=_resetRecordPid)
+
@@ -10,8 +10,6 @@ except ImportError:
     import http.client as httplib
 import xml.dom.minidom
 
-from OpenSSL import crypto
-
 import gratia.common.connect_utils as connect_utils
 import gratia.common.utils as utils
 import gratia.common.bundle as bundle
@@ -35,6 +33,7 @@ class ProbeConfiguration:
     """
     
     __doc = None
+    __attributes = None
     __configname = 'ProbeConfig'
     __CollectorHost = None
     __ProbeName = None
@@ -60,6 +59,10 @@ class ProbeConfiguration:
 
     def __loadConfiguration__(self):
         self.__doc = xml.dom.minidom.parse(self.__configname)
+        # Read all the attributes at once rather than searching the DOM for
+        # the ProbeConfiguration node on every lookup
+        node = self.__doc.getElementsByTagName('ProbeConfiguration')[0]
+        self.__attributes = dict(node.attributes.items())
         DebugPrint(1, 'Using config file: ' + self.__configname)
 
     def __getConfigAttribute(self, attributeName):
@@ -75,9 +78,8 @@ class ProbeConfiguration:
                 raise
 
         # TODO:  Check if the ProbeConfiguration node exists
-        # TODO:  Check if the requested attribute exists
 
-        return self.__doc.getElementsByTagName('ProbeConfiguration')[0].getAttribute(attributeName)
+        return self.__attributes.get(attributeName, '')
 
     # Public interface
 
@@ -206,6 +208,9 @@ class ProbeConfiguration:
             filename = 'gratia.probecert.pem'
         filename = self.__get_fullpath_cert(filename)
         keyfile = self.get_GratiaKeyFile()
+        # pyOpenSSL is slow to import and only needed when Gratia certificates
+        # are in use, so don't load it at probe startup
+        from OpenSSL import crypto
         try:
             cryptofile = open(filename, 'r')
             cert = crypto.load_certificate(crypto.FILETYPE_PEM, cryptofile.read())
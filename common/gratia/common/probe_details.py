@@ -1,6 +1,5 @@
 
 import time
-import socket
 
 import gratia.common.global_state as global_state
 import gratia.common.utils as utils
@@ -69,7 +68,7 @@ class ProbeDetails(record.Record):
 
         # Add the record indentity
 
-        self.XmlData.append('<RecordIdentity recordId="' + socket.getfqdn() + ':' + str(global_state.RecordPid) + '.'
+        self.XmlData.append('<RecordIdentity recordId="' + global_state.getHostFQDN() + ':' + str(global_state.RecordPid) + '.'
                             + str(record.RecordId) + '" createTime="' + utils.TimeToString(time.gmtime()) + '" />\n')
         record.RecordId += 1
 
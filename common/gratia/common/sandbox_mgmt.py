@@ -6,6 +6,7 @@ import glob
 import time
 import shutil
 import tarfile
+import tempfile
 
 from gratia.common.config import ConfigProxy
 from gratia.common.file_utils import RemoveFile
@@ -409,18 +410,11 @@ def SearchOutstandingRecord():
 
 def GenerateFilename(prefix, current_dir):
     '''Generate a filename of the for current_dir/prefix.$pid.ConfigFragment.gratia.xml__Unique'''
-    filename = prefix + str(global_state.RecordPid) + '.' + Config.get_GratiaExtension() \
-        + '__XXXXXXXXXX'
-    filename = os.path.join(current_dir, filename)
-    mktemp_pipe = os.popen('mktemp -q "' + filename + '"')
-    if mktemp_pipe != None:
-        filename = mktemp_pipe.readline()
-        mktemp_pipe.close()
-        filename = filename.strip()
-        if filename != r'':
-            return filename
-
-    raise IOError
+    # Create the file in-process rather than running `mktemp` for every record
+    filename = prefix + str(global_state.RecordPid) + '.' + Config.get_GratiaExtension() + '__'
+    fd, filename = tempfile.mkstemp(prefix=filename, dir=current_dir)
+    os.close(fd)
+    return filename
 
 def UncompressOutbox(staging_name, target_dir):
 
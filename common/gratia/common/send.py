@@ -74,8 +74,12 @@ def Send(record):
 
         # Generate the XML
 
+        # The collector web service requires the xml to be sent as a single
+        # string, so keep it as one rather than splitting it into lines.
+
         DebugPrint(4, 'DEBUG: Generating data to send')
-        record.XmlData = safeEncodeXML(xmlDoc).splitlines(True)
+        usageXmlString = safeEncodeXML(xmlDoc)
+        record.XmlData = [usageXmlString]
         DebugPrint(4, 'DEBUG: Generating data to send: OK')
 
         # Close and clean up the document2
@@ -93,8 +97,7 @@ def Send(record):
             DebugPrint(3, 'dirIndex=', dirIndex)
             if f.name != '<stdout>':
                 try:
-                    for line in record.XmlData:
-                        f.write(line)
+                    f.write(usageXmlString)
                     f.flush()
                     if f.tell() > 0:
                         success = True
@@ -121,13 +124,6 @@ def Send(record):
             else:
                 break
 
-        # Currently, the recordXml is in a list format, with each item being a line of xml.
-        # the collector web service requires the xml to be sent as a string.
-        # This logic here turns the xml list into a single xml string.
-
-        usageXmlString = r''
-        for line in record.XmlData:
-            usageXmlString = usageXmlString + line
         DebugPrint(3, 'UsageXml:  ' + usageXmlString)
 
         connectionProblem = connect_utils.connectionRetries > 0 or connect_utils.connectionError
@@ -345,12 +341,9 @@ def SendXMLFiles(fileDir, removeOriginal=False, resourceType=None):
 
         # Currently, the recordXml is in a list format, with each
         # item being a line of xml. The collector web service
-        # requires the xml to be sent as a string. This logic here
-        # turns the xml list into a single xml string.
+        # requires the xml to be sent as a string.
 
-        usageXmlString = r''
-        for line in xmlData:
-            usageXmlString = usageXmlString + line
+        usageXmlString = ''.join(xmlData)
         DebugPrint(3, 'UsageXml:  ' + usageXmlString)
 
         if global_state.bundle_size > 1 and f.name != '<stdout>':
@@ -435,21 +428,15 @@ def SendHandshake(record):
 
     xmlDoc.normalize()
 
-    # Generate the XML
+    # Generate the XML; the collector web service requires it as a single string
 
-    record.XmlData = safeEncodeXML(xmlDoc).splitlines(True)
+    usageXmlString = safeEncodeXML(xmlDoc)
+    record.XmlData = [usageXmlString]
 
     # Close and clean up the document
 
     xmlDoc.unlink()
 
-    # Currently, the recordXml is in a list format, with each item being a line of xml.
-    # the collector web service requires the xml to be sent as a string.
-    # This logic here turns the xml list into a single xml string.
-
-    usageXmlString = r''
-    for line in record.XmlData:
-        usageXmlString = usageXmlString + line
     DebugPrint(3, 'UsageXml:  ' + usageXmlString)
 
     connectionProblem = connect_utils.connectionRetries > 0 or connect_utils.connectionError
@@ -13,7 +13,7 @@ import gratia.common.certinfo as certinfo
 import gratia.common.condor_ce as condor_ce
 import gratia.common.sandbox_mgmt as sandbox_mgmt
 
-from gratia.common.debug import DebugPrint, DebugPrintTraceback
+from gratia.common.debug import DebugPrint, DebugPrintTraceback, debug_enabled
 
 Config = config.ConfigProxy()
 
@@ -150,7 +150,10 @@ def UsageCheckXmldoc(xmlDoc, external, resourceType=None):
     if not xmlDoc.documentElement:  # Major problem
         return 0
     DebugPrint(4, 'DEBUG: Checking xmlDoc integrity: OK')
-    DebugPrint(4, 'DEBUG: XML record to send: \n' + xmlDoc.toxml())
+    # Serializing the whole document is as costly as the rest of the check,
+    # so only do it when the message will actually be printed or logged
+    if debug_enabled(4):
+        DebugPrint(4, 'DEBUG: XML record to send: \n' + xmlDoc.toxml())
 
     # Local namespace
 
@@ -159,7 +162,9 @@ def UsageCheckXmldoc(xmlDoc, external, resourceType=None):
     # Loop over (posibly multiple) jobUsageRecords
 
     DebugPrint(4, 'DEBUG: About to examine individual UsageRecords')
-    for usageRecord in getUsageRecords(xmlDoc):
+    usageRecords = getUsageRecords(xmlDoc)
+    suppressed = 0
+    for usageRecord in usageRecords:
         DebugPrint(4, 'DEBUG: Examining UsageRecord')
         DebugPrint(4, 'DEBUG: Looking for prefix')
 
@@ -285,9 +290,10 @@ def UsageCheckXmldoc(xmlDoc, external, resourceType=None):
                 usageRecord.writexml(writer)
                 writer.close()
             usageRecord.unlink()
+            suppressed += 1
             continue
 
-    return len(getUsageRecords(xmlDoc))
+    return len(usageRecords) - suppressed
 
 
 XmlChecker.AddChecker(UsageCheckXmldoc)
@@ -3,7 +3,6 @@
 
 import time
 import types
-import socket
 import xml.dom.minidom
 
 import gratia.common.global_state as global_state
@@ -38,7 +37,7 @@ class ComputeElement(record.Record):
         self.XmlData.append("<ComputeElement xmlns:urwg=\"http://www.gridforum.org/2003/ur-wg\">\n")
 
         # Add the record indentity
-        self.XmlData.append("<RecordIdentity urwg:recordId=\""+socket.getfqdn()+":"+
+        self.XmlData.append("<RecordIdentity urwg:recordId=\""+global_state.getHostFQDN()+":"+
                             str(global_state.RecordPid)+"."+str(record.RecordId)+"\" urwg:createTime=\""+utils.TimeToString(time.gmtime())+"\" />\n")
         record.RecordId += 1
 
@@ -128,7 +127,8 @@ def ComputeElementCheckXmldoc(xmlDoc,external,resourceType = None):
     # Local namespace
     namespace = xmlDoc.documentElement.namespaceURI
     # Loop over (posibly multiple) jobUsageRecords
-    for computeElementDescription in getComputeElements(xmlDoc):
+    records = getComputeElements(xmlDoc)
+    for computeElementDescription in records:
         # Local namespace and prefix, if any
         prefix = ""
         for child in computeElementDescription.childNodes:
@@ -139,7 +139,7 @@ def ComputeElementCheckXmldoc(xmlDoc,external,resourceType = None):
                                
         xml_utils.StandardCheckXmldoc(xmlDoc,computeElementDescription,external,prefix)
             
-    return len(getComputeElements(xmlDoc))
+    return len(records)
 
 xml_utils.XmlChecker.AddChecker(ComputeElementCheckXmldoc)
 
@@ -3,7 +3,6 @@
 
 import time
 import types
-import socket
 import xml.dom.minidom
 
 import gratia.common.global_state as global_state
@@ -38,7 +37,7 @@ class ComputeElementRecord(record.Record):
         self.XmlData.append("<ComputeElementRecord xmlns:urwg=\"http://www.gridforum.org/2003/ur-wg\">\n")
 
         # Add the record indentity
-        self.XmlData.append("<RecordIdentity urwg:recordId=\""+socket.getfqdn()+":"+
+        self.XmlData.append("<RecordIdentity urwg:recordId=\""+global_state.getHostFQDN()+":"+
                             str(global_state.RecordPid)+"."+str(record.RecordId)+"\" urwg:createTime=\""+utils.TimeToString(time.gmtime())+"\" />\n")
         record.RecordId += 1
 
@@ -99,7 +98,8 @@ def ComputeElementRecordCheckXmldoc(xmlDoc,external,resourceType = None):
     # Local namespace
     namespace = xmlDoc.documentElement.namespaceURI
     # Loop over (posibly multiple) jobUsageRecords
-    for ComputeElementRecord in getComputeElementRecords(xmlDoc):
+    records = getComputeElementRecords(xmlDoc)
+    for ComputeElementRecord in records:
         # Local namespace and prefix, if any
         prefix = ""
         for child in ComputeElementRecord.childNodes:
@@ -110,7 +110,7 @@ def ComputeElementRecordCheckXmldoc(xmlDoc,external,resourceType = None):
                                
         xml_utils.StandardCheckXmldoc(xmlDoc,ComputeElementRecord,external,prefix)
             
-    return len(getComputeElementRecords(xmlDoc))
+    return len(records)
 
 xml_utils.XmlChecker.AddChecker(ComputeElementRecordCheckXmldoc)
 
@@ -3,7 +3,6 @@
 
 import time
 import types
-import socket
 import xml.dom.minidom
 
 import gratia.common.global_state as global_state
@@ -38,7 +37,7 @@ class StorageElement(record.Record):
         self.XmlData.append("<StorageElement xmlns:urwg=\"http://www.gridforum.org/2003/ur-wg\">\n")
 
         # Add the record indentity
-        self.XmlData.append("<RecordIdentity urwg:recordId=\""+socket.getfqdn()+":"+
+        self.XmlData.append("<RecordIdentity urwg:recordId=\""+global_state.getHostFQDN()+":"+
                             str(global_state.RecordPid)+"."+str(record.RecordId)+"\" urwg:createTime=\""+utils.TimeToString(time.gmtime())+"\" />\n")
         record.RecordId += 1
 
@@ -126,7 +125,8 @@ def StorageElementCheckXmldoc(xmlDoc,external,resourceType = None):
     # Local namespace
     namespace = xmlDoc.documentElement.namespaceURI
     # Loop over (posibly multiple) jobUsageRecords
-    for StorageElement in getStorageElements(xmlDoc):
+    records = getStorageElements(xmlDoc)
+    for StorageElement in records:
         # Local namespace and prefix, if any
         prefix = ""
         for child in StorageElement.childNodes:
@@ -137,7 +137,7 @@ def StorageElementCheckXmldoc(xmlDoc,external,resourceType = None):
                                
         xml_utils.StandardCheckXmldoc(xmlDoc,StorageElement,external,prefix)
             
-    return len(getStorageElements(xmlDoc))
+    return len(records)
 
 xml_utils.XmlChecker.AddChecker(StorageElementCheckXmldoc)
 
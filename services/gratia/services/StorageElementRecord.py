@@ -3,7 +3,6 @@
 
 import time
 import types
-import socket
 import xml.dom.minidom
 
 import gratia.common.global_state as global_state
@@ -38,7 +37,7 @@ class StorageElementRecord(record.Record):
         self.XmlData.append("<StorageElementRecord xmlns:urwg=\"http://www.gridforum.org/2003/ur-wg\">\n")
 
         # Add the record indentity
-        self.XmlData.append("<RecordIdentity urwg:recordId=\""+socket.getfqdn()+":"+
+        self.XmlData.append("<RecordIdentity urwg:recordId=\""+global_state.getHostFQDN()+":"+
                             str(global_state.RecordPid)+"."+str(record.RecordId)+"\" urwg:createTime=\""+utils.TimeToString(time.gmtime())+"\" />\n")
         record.RecordId += 1
 
@@ -117,7 +116,8 @@ def StorageElementRecordCheckXmldoc(xmlDoc,external,resourceType = None):
     # Local namespace
     namespace = xmlDoc.documentElement.namespaceURI
     # Loop over (posibly multiple) jobUsageRecords
-    for StorageElementRecord in getStorageElementRecords(xmlDoc):
+    records = getStorageElementRecords(xmlDoc)
+    for StorageElementRecord in records:
         # Local namespace and prefix, if any
         prefix = ""
         for child in StorageElementRecord.childNodes:
@@ -128,7 +128,7 @@ def StorageElementRecordCheckXmldoc(xmlDoc,external,resourceType = None):
                                
         xml_utils.StandardCheckXmldoc(xmlDoc,StorageElementRecord,external,prefix)
             
-    return len(getStorageElementRecords(xmlDoc))
+    return len(records)
 
 xml_utils.XmlChecker.AddChecker(StorageElementRecordCheckXmldoc)
 
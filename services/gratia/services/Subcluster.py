@@ -3,7 +3,6 @@
 
 import time
 import types
-import socket
 import xml.dom.minidom
 
 import gratia.common.global_state as global_state
@@ -40,7 +39,7 @@ class Subcluster(record.Record):
         self.XmlData.append("<Subcluster xmlns:urwg=\"http://www.gridforum.org/2003/ur-wg\">\n")
 
         # Add the record indentity
-        self.XmlData.append("<RecordIdentity urwg:recordId=\""+socket.getfqdn()+":"+
+        self.XmlData.append("<RecordIdentity urwg:recordId=\""+global_state.getHostFQDN()+":"+
                             str(global_state.RecordPid)+"."+str(record.RecordId)+"\" urwg:createTime=\""+utils.TimeToString(time.gmtime())+"\" />\n")
         record.RecordId += 1
 
@@ -150,7 +149,8 @@ def SubclusterCheckXmldoc(xmlDoc, external, resourceType = None):
     # Local namespace
     # namespace = xmlDoc.documentElement.namespaceURI
     # Loop over (posibly multiple) jobUsageRecords
-    for subClusterNode in getSubclusters(xmlDoc):
+    records = getSubclusters(xmlDoc)
+    for subClusterNode in records:
         # Local namespace and prefix, if any
         prefix = ""
         for child in subClusterNode.childNodes:
@@ -161,7 +161,7 @@ def SubclusterCheckXmldoc(xmlDoc, external, resourceType = None):
                                
         xml_utils.StandardCheckXmldoc(xmlDoc, subClusterNode, external, prefix)
             
-    return len(getSubclusters(xmlDoc))
+    return len(records)
 
 xml_utils.XmlChecker.AddChecker(SubclusterCheckXmldoc)
 
@@ -1,5 +1,9 @@
 #!/bin/env python
 
+import io
+import os
+import tempfile
+import time
 import unittest
 from unittest.mock import patch
 import classad
@@ -28,6 +32,13 @@ class ProcessorCountTests(unittest.TestCase):
             procs = condor.get_num_procs(jobad)
             self.assertEqual(procs, 4)
 
+    def test_proc_case_insensitive(self):
+        """Attribute names should be matched case-insensitively
+        """
+        jobad = classad.ClassAd()
+        jobad['requestcpus'] = 3
+        self.assertEqual(condor.get_num_procs(jobad), 3)
+
     def test_proc_int(self):
         """The Processors field should always return an integer
         """
@@ -38,6 +49,354 @@ class ProcessorCountTests(unittest.TestCase):
             self.assertIsInstance(procs, int)
 
 
+class ProbeConfigTestCase(unittest.TestCase):
+    """Base class for tests that read ProbeConfig attributes; set them in self.probe_config
+    """
+
+    def setUp(self):
+        self.probe_config = {}
+        gratia_config = patch('gratia.common.condor.GratiaCore.Config')
+        mock_config = gratia_config.start()
+        mock_config.getConfigAttribute.side_effect = lambda attr: self.probe_config.get(attr, '')
+        self.addCleanup(gratia_config.stop)
+
+
+class CondorVersionTests(ProbeConfigTestCase):
+    """Tests for reporting the HTCondor version
+    """
+
+    @patch('htcondor.platform', return_value='$CondorPlatform: X86_64-CentOS_7.9 $')
+    @patch('htcondor.version', return_value='$CondorVersion: 9.0.17 Oct 04 2022 BuildID: 608407 $')
+    @patch('gratia.common.condor.subprocess.Popen')
+    def test_version_from_bindings(self, mock_popen, mock_version, mock_platform):
+        """The version string should come from the bindings without running condor_version
+        """
+        self.assertEqual(condor.getCondorVersion(),
+                         '9.0.17 Oct 04 2022 BuildID: 608407 / X86_64-CentOS_7.9')
+        mock_popen.assert_not_called()
+
+    @patch('gratia.common.condor.htcondor', spec=[])
+    @patch('gratia.common.condor.subprocess.Popen')
+    def test_version_without_bindings(self, mock_popen, mock_htcondor):
+        """condor_version is run when the bindings don't provide version()
+        """
+        mock_popen.return_value.communicate.return_value = \
+            ('$CondorVersion: 8.8.0 Jan 01 2019 $\n$CondorPlatform: x86_64_RedHat7 $\n', None)
+        mock_popen.return_value.returncode = 0
+
+        self.assertEqual(condor.getCondorVersion(), '8.8.0 Jan 01 2019 / x86_64_RedHat7')
+        self.assertEqual(mock_popen.call_args[0][0], ['condor_version'])
+
+    @patch('gratia.common.condor.htcondor', spec=[])
+    @patch('gratia.common.condor.subprocess.Popen', side_effect=OSError)
+    def test_no_condor_version(self, mock_popen, mock_htcondor):
+        """Failing to run condor_version is an error
+        """
+        with self.assertRaises(Exception):
+            condor.getCondorVersion()
+
+    @patch('os.path.exists', return_value=True)
+    @patch('htcondor.version')
+    @patch('gratia.common.condor.subprocess.Popen')
+    def test_version_from_condor_location(self, mock_popen, mock_version, mock_exists):
+        """condor_version from CondorLocation is used instead of the bindings
+        """
+        self.probe_config['CondorLocation'] = '/opt/condor'
+        mock_popen.return_value.communicate.return_value = \
+            ('$CondorVersion: 10.0.0 Jan 01 2023 $\n$CondorPlatform: x86_64_AlmaLinux9 $\n', None)
+        mock_popen.return_value.returncode = 0
+
+        self.assertEqual(condor.getCondorVersion(), '10.0.0 Jan 01 2023 / x86_64_AlmaLinux9')
+        self.assertEqual(mock_popen.call_args[0][0], ['/opt/condor/bin/condor_version'])
+        mock_version.assert_not_called()
+
+
+class ParseDateTests(unittest.TestCase):
+    """Tests for parsing --start-time and --end-time
+    """
+
+    def test_formats(self):
+        """Both date and date/time formats are interpreted as local time
+        """
+        self.assertEqual(condor.parse_date('2023-01-02'),
+                         int(time.mktime((2023, 1, 2, 0, 0, 0, 0, 0, -1))))
+        self.assertEqual(condor.parse_date('2023-01-02 03:04:05'),
+                         int(time.mktime((2023, 1, 2, 3, 4, 5, 0, 0, -1))))
+
+    def test_invalid(self):
+        """Unparseable dates return None
+        """
+        for date_string in ('01-02-2023', '2023-13-01', 'yesterday', None):
+            self.assertIsNone(condor.parse_date(date_string))
+
+
+class LogfileTests(unittest.TestCase):
+    """Tests for per-job history file discovery
+    """
+
+    def test_logfile_names(self):
+        """Only per-job history file names should be matched
+        """
+        for name in ('history.377260.0', 'history.schedd#377260.12'):
+            self.assertIsNotNone(condor.logfile_re.fullmatch(name), name)
+        for name in ('history', 'history.377260', 'history.377260.0.tmp', 'xhistory.1.0',
+                     'history.a#b#1.0'):
+            self.assertIsNone(condor.logfile_re.fullmatch(name), name)
+
+    def test_logfiles_to_process(self):
+        """Directories are scanned for history files; other entries are skipped
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ('history.1.0', 'history.2.0', 'README'):
+                with open(os.path.join(tmpdir, name), 'w') as fd:
+                    fd.write('ClusterId = 1\n')
+            found = sorted(condor.logfiles_to_process([tmpdir]))
+        self.assertEqual(found, [os.path.join(tmpdir, 'history.1.0'),
+                                 os.path.join(tmpdir, 'history.2.0')])
+
+    def test_logfile_args(self):
+        """Empty or missing file arguments and history-named directories are skipped
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logfile = os.path.join(tmpdir, 'history.1.0')
+            with open(logfile, 'w') as fd:
+                fd.write('ClusterId = 1\n')
+            empty = os.path.join(tmpdir, 'history.2.0')
+            open(empty, 'w').close()
+            os.mkdir(os.path.join(tmpdir, 'history.3.0'))
+            missing = os.path.join(tmpdir, 'history.4.0')
+            found = list(condor.logfiles_to_process([logfile, empty, missing]))
+            self.assertEqual(found, [logfile])
+            found = sorted(condor.logfiles_to_process([tmpdir]))
+        self.assertEqual(found, [logfile, empty])
+
+
+def fake_read_history_file(logfile):
+    """Stand-in for read_history_file that worker processes can run without a probe config
+    """
+    with open(logfile) as fd:
+        contents = fd.read()
+    if not contents:
+        raise ValueError("empty history file")
+    return 0, 1, [contents], []
+
+
+class HistoryDirTests(unittest.TestCase):
+    """Tests for converting history directories
+    """
+
+    @patch('gratia.common.condor.send_alternate_records')
+    @patch('gratia.common.condor.GratiaCore.QuarantineFile')
+    @patch('gratia.common.condor.read_history_file', fake_read_history_file)
+    def process_history_dirs(self, dirs, jobs, mock_quarantine, mock_alternate):
+        sent = []
+        def send_history_records(count_submit, count_found, records, alternate_records):
+            sent.extend(records)
+            return len(records), count_found, 0
+        with patch('gratia.common.condor.send_history_records', send_history_records), \
+             patch('os.cpu_count', return_value=jobs):
+            condor.process_history_dirs(dirs, jobs)
+        quarantined = [call[0][0] for call in mock_quarantine.call_args_list]
+        return sent, quarantined
+
+    def test_parallel_history_dirs(self):
+        """Converting history files in worker processes gives the same results as converting them serially
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for i in range(5 * condor.history_file_chunksize):
+                with open(os.path.join(tmpdir, 'history.%d.0' % i), 'w') as fd:
+                    if i % 7:
+                        fd.write('ClusterId = %d\n' % i)
+            serial_sent, serial_quarantined = self.process_history_dirs([tmpdir], 1)
+            parallel_sent, parallel_quarantined = self.process_history_dirs([tmpdir], 2)
+
+        self.assertEqual(len(serial_sent), 5 * condor.history_file_chunksize - 12)
+        self.assertEqual(sorted(parallel_sent), sorted(serial_sent))
+        self.assertEqual(len(serial_quarantined), 12)
+        self.assertEqual(sorted(parallel_quarantined), sorted(serial_quarantined))
+
+
+class FdToClassadTests(unittest.TestCase):
+    """Tests for reading condor_history -l output
+    """
+
+    def test_fd_to_classad(self):
+        """Blank lines separate ClassAds; a trailing blank line does not add an empty one
+        """
+        text = 'ClusterId = 1\nGlobalJobId = "schedd#1.0#1"\n\nClusterId = 2\nCmd = "/bin/true"\n\n'
+        ads = list(condor.fd_to_classad(io.StringIO(text)))
+        self.assertEqual([ad['ClusterId'] for ad in ads], [1, 2])
+        self.assertEqual(ads[0]['UniqGlobalJobId'], 'condor.schedd#1.0#1')
+        self.assertEqual(ads[1]['Cmd'], '/bin/true')
+
+
+class HostDescriptionTests(unittest.TestCase):
+    """Tests for glideinWMS host descriptions
+    """
+
+    def make_jobad(self, **attrs):
+        jobad = classad.ClassAd()
+        jobad['MachineAttrGLIDEIN_ResourceName0'] = 'MySite'
+        for attr, val in attrs.items():
+            jobad[attr] = val
+        return jobad
+
+    def test_no_resource_name(self):
+        """Jobs without a glidein resource name have no special description
+        """
+        self.assertIsNone(condor.determine_host_description(classad.ClassAd()))
+
+    def test_se_match(self):
+        """A matched SE in DESIRED_SEs is not an overflow job
+        """
+        jobad = self.make_jobad(DESIRED_SEs='se1.example.com, se2.example.com',
+                                MATCH_GLIDEIN_SEs='se2.example.com ')
+        self.assertEqual(condor.determine_host_description(jobad), 'MySite')
+
+    def test_cream_match(self):
+        """CREAM gatekeepers are matched against their contact string
+        """
+        jobad = self.make_jobad(DESIRED_SEs='se1.example.com',
+                                MATCH_GLIDEIN_SEs='se2.example.com',
+                                DESIRED_Gatekeepers='gk.example.com,llrcream.in2p3.fr:8443/cream-pbs',
+                                MATCH_GLIDEIN_Gatekeeper='https://llrcream.in2p3.fr:8443/ce-cream/services/CREAM2 pbs cms')
+        self.assertEqual(condor.determine_host_description(jobad), 'MySite')
+
+    def test_overflow(self):
+        """Neither the SE nor the CE matched
+        """
+        jobad = self.make_jobad(DESIRED_SEs='se1.example.com',
+                                MATCH_GLIDEIN_SEs='se2.example.com',
+                                DESIRED_Gatekeepers='gk1.example.com, gk2.example.com',
+                                MATCH_GLIDEIN_Gatekeeper='gk3.example.com')
+        self.assertEqual(condor.determine_host_description(jobad), 'MySite-overflow')
+
+
+class SubmitHostTests(unittest.TestCase):
+    """Tests for extracting the submit host from a GlobalJobId
+    """
+
+    def test_submit_host(self):
+        """The submit host precedes the job ID
+        """
+        self.assertEqual(condor.get_submit_host('submit.example.com#377260.0#1290671437'),
+                         'submit.example.com')
+        self.assertEqual(condor.get_submit_host('submit.example.com#377260#1290671437'),
+                         'submit.example.com')
+
+    def test_malformed(self):
+        """GlobalJobIds without a job ID have no submit host
+        """
+        for global_job_id in ('submit.example.com', 'submit.example.com#377260.0',
+                              'submit.example.com#abc#1290671437'):
+            self.assertIsNone(condor.get_submit_host(global_job_id))
+
+
+class CollectorHostTests(unittest.TestCase):
+    """Tests for parsing COLLECTOR_HOST
+    """
+
+    @patch('gratia.common.condor.get_collector_host')
+    def test_collector_host_names(self, mock_collector_host):
+        """Ports are stripped and sinful strings are replaced by their alias
+        """
+        mock_collector_host.return_value = 'cm1.example.com:9618, cm2.example.com ' \
+                                           '<192.0.2.1:9618?addrs=192.0.2.1-9618&alias=cm3.example.com> ' \
+                                           '<192.0.2.2:9618?addrs=192.0.2.2-9618>'
+        self.assertEqual(condor.get_collector_host_names(),
+                         ['cm1.example.com', 'cm2.example.com', 'cm3.example.com'])
+
+    @patch('gratia.common.condor.get_collector_host')
+    def test_no_collector_host(self, mock_collector_host):
+        """No host names are returned if COLLECTOR_HOST can't be determined
+        """
+        mock_collector_host.return_value = None
+        self.assertEqual(condor.get_collector_host_names(), [])
+
+
+class CompletionDateTests(unittest.TestCase):
+    """Tests for the job completion date used to skip old jobs
+    """
+
+    def test_completion_date(self):
+        """CompletionDate is preferred over EnteredCurrentStatus
+        """
+        jobad = classad.ClassAd({'CompletionDate': 100, 'EnteredCurrentStatus': 200})
+        self.assertEqual(condor.get_completion_date(jobad), 100)
+
+    def test_entered_current_status(self):
+        """Jobs that never completed fall back to EnteredCurrentStatus without modifying the JobAd
+        """
+        jobad = classad.ClassAd({'CompletionDate': 0, 'EnteredCurrentStatus': 200})
+        self.assertEqual(condor.get_completion_date(jobad), 200)
+        self.assertEqual(jobad['CompletionDate'], 0)
+        self.assertEqual(condor.get_completion_date(classad.ClassAd()), 0)
+
+
+class CondorHistoryTests(ProbeConfigTestCase):
+    """Tests for choosing between condor_history and the schedd history query
+    """
+    def setUp(self):
+        super().setUp()
+        report = patch('gratia.common.condor.report_condor_history')
+        self.mock_report = report.start()
+        history_command = patch('gratia.common.condor.process_condor_history_command')
+        self.mock_history_command = history_command.start()
+        schedd = patch('htcondor.Schedd')
+        self.mock_schedd = schedd.start()
+        reload_config = patch('htcondor.reload_config')
+        reload_config.start()
+
+        self.addCleanup(report.stop)
+        self.addCleanup(history_command.stop)
+        self.addCleanup(schedd.stop)
+        self.addCleanup(reload_config.stop)
+
+    def test_condor_history_default(self):
+        """condor_history is used unless the schedd query is enabled
+        """
+        condor.process_condor_history(100, 200)
+
+        self.mock_history_command.assert_called_once_with(100, 200)
+        self.mock_schedd.assert_not_called()
+
+    @patch('gratia.common.condor.DebugPrint')
+    @patch('gratia.common.condor.process_history_ads')
+    def test_schedd_history_query(self, mock_process_ads, mock_debug):
+        """UseScheddHistoryQuery reads the ads from the schedd and adds unique IDs
+        """
+        self.probe_config['UseScheddHistoryQuery'] = '1'
+        self.mock_schedd.return_value.history.return_value = \
+            [classad.ClassAd({'ClusterId': 1, 'GlobalJobId': 'schedd#1.0#1'})]
+        ads = []
+        def process_ads(history, source):
+            ads.extend(history)
+            return 0, len(ads), 0
+        mock_process_ads.side_effect = process_ads
+
+        condor.process_condor_history(100, 200)
+
+        self.mock_history_command.assert_not_called()
+        constraint = self.mock_schedd.return_value.history.call_args[0][0]
+        self.assertIn('JobCurrentStartDate > 100', str(constraint))
+        self.assertEqual(ads[0]['UniqGlobalJobId'], 'condor.schedd#1.0#1')
+        self.mock_report.assert_called_once_with(0, 1, 0)
+        self.assertFalse(any('HISTORY_HELPER_MAX_HISTORY' in str(call) for call in mock_debug.call_args_list))
+
+    @patch('htcondor.param', {'HISTORY_HELPER_MAX_HISTORY': '2'})
+    @patch('gratia.common.condor.DebugPrint')
+    @patch('gratia.common.condor.process_history_ads', return_value=(2, 2, 0))
+    def test_schedd_history_limit(self, mock_process_ads, mock_debug):
+        """Reaching HISTORY_HELPER_MAX_HISTORY is reported as possible missing jobs
+        """
+        self.probe_config['UseScheddHistoryQuery'] = '1'
+
+        condor.process_condor_history()
+
+        self.assertTrue(any('HISTORY_HELPER_MAX_HISTORY' in str(call) for call in mock_debug.call_args_list))
+        self.mock_report.assert_called_once_with(2, 2, 0)
+
+
 class CondorIDsTest(unittest.TestCase):
     """Unit tests for detecting condor user UID and GID
     """
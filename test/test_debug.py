@@ -0,0 +1,42 @@
+#!/bin/env python
+
+import unittest
+from unittest.mock import patch, MagicMock
+
+import gratia.common.debug as debug
+
+
+class DebugEnabledTests(unittest.TestCase):
+    """Tests for checking whether a debug message would be emitted
+    """
+
+    def setUp(self):
+        self.config = MagicMock()
+        self.config.get_DebugLevel.return_value = 2
+        self.config.get_LogLevel.return_value = 4
+        self.config.get_UseSyslog.return_value = False
+        get_config = patch('gratia.common.debug.getGratiaConfig', return_value=self.config)
+        get_config.start()
+        self.addCleanup(get_config.stop)
+
+    @patch('gratia.common.debug.LogToFile')
+    @patch('sys.stderr')
+    def test_matches_debug_print(self, mock_stderr, mock_log):
+        """debug_enabled() is True exactly when DebugPrint() prints or logs the message
+        """
+        for level in range(-1, 7):
+            mock_stderr.reset_mock()
+            mock_log.reset_mock()
+            debug.DebugPrint(level, 'message')
+            emitted = mock_stderr.write.called or mock_log.called
+            self.assertEqual(debug.debug_enabled(level), emitted, level)
+
+    def test_no_config(self):
+        """Nothing is emitted before the probe configuration is loaded
+        """
+        with patch('gratia.common.debug.getGratiaConfig', return_value=None):
+            self.assertFalse(debug.debug_enabled(-1))
+
+
+if __name__ == '__main__':
+    unittest.main()